@@ -0,0 +1,126 @@
+import commons as COM
+import numpy as np
+import os
+
+
+"""
+  Inverted file index (IVF) over the rows of a ConceptStore, for the approximate search
+  in large symptom trees.
+  
+  The normalized vectors of the store are clustered with the spherical k-means in n_lists lists.
+  A search scores only the rows in the n_probes lists whose centroids are the most similar
+  to the query: more probes => higher recall, slower search.
+  
+  An index is a directory ivf<n_lists>/ inside the directory of the store, with these files:
+    - centroids.npy: float32 matrix n_lists x d, rows L2-normalized
+    - offsets.npy: the rows of the list i are rows[offsets[i]:offsets[i+1]]
+    - rows.npy: rows of the store grouped by list
+  
+  The index is deleted together with the store when the store is saved again.
+"""
+
+
+class IVFIndex:
+  
+  
+  def __init__(self, centroids, offsets, rows):
+    self.centroids = centroids
+    self.offsets = offsets
+    self.rows = rows
+    self.n_lists = len(centroids)
+  
+  
+  """
+  Returns the sorted rows of the store in the n_probes lists closest to any row of A
+  """
+  def get_candidates(self, A, n_probes=COM.DEFAULT_IVF_PROBES):
+    A = np.asarray(A, dtype=np.float32)
+    n_probes = min(n_probes, self.n_lists)
+    
+    # the norms of the rows of A don't change the ranking of the centroids
+    centroid_similarities = A @ self.centroids.T
+    
+    if n_probes < self.n_lists:
+      lists = np.argpartition(-centroid_similarities, n_probes - 1, axis=1)[:, :n_probes]
+      lists = np.unique(lists)
+    else:
+      lists = np.arange(self.n_lists)
+    
+    return np.sort(np.concatenate([self.rows[self.offsets[l]:self.offsets[l + 1]] for l in lists]))
+
+
+def get_default_number_lists(number_rows):
+  return max(1, int(round(np.sqrt(number_rows))))
+
+
+def get_ivf_index_path(store_path, n_lists):
+  return store_path + "ivf" + str(n_lists) + "/"
+
+
+def exists_ivf_index(path):
+  return os.path.isfile(path + "rows.npy")
+
+
+def load_ivf_index(path):
+  return IVFIndex(np.load(path + "centroids.npy"),
+                  np.load(path + "offsets.npy"),
+                  np.load(path + "rows.npy"))
+
+
+"""
+Index of the rows closest to each centroid, computed by blocks
+so a memory-mapped matrix is never loaded in memory at once
+"""
+def assign_to_centroids(vectors, centroids):
+  assignments = np.zeros(len(vectors), dtype=np.int64)
+  
+  for start in range(0, len(vectors), COM.IVF_BLOCK_SIZE):
+    end = min(start + COM.IVF_BLOCK_SIZE, len(vectors))
+    block = np.asarray(vectors[start:end], dtype=np.float32)
+    assignments[start:end] = (block @ centroids.T).argmax(axis=1)
+  
+  return assignments
+
+
+"""
+Train n_lists centroids with the spherical k-means on a sample of the normalized vectors
+of the store (e.g. ConceptStore.vectors), assign every row to its closest centroid
+and save the index in path
+"""
+def build_ivf_index(path,
+                    vectors,
+                    n_lists,
+                    iterations=COM.IVF_KMEANS_ITERATIONS,
+                    sample_size=COM.IVF_KMEANS_SAMPLE_SIZE,
+                    seed=0):
+  rng = np.random.RandomState(seed)
+  n_lists = min(n_lists, len(vectors))
+  
+  sample = np.sort(rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False))
+  X = np.asarray(vectors[sample], dtype=np.float32)
+  centroids = X[rng.choice(len(X), n_lists, replace=False)]
+  
+  for _ in range(iterations):
+    assignments = assign_to_centroids(X, centroids)
+    order = np.argsort(assignments, kind="stable")
+    counts = np.bincount(assignments, minlength=n_lists)
+    non_empty = np.flatnonzero(counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    
+    # the centroid of a list is its normalized mean, empty lists keep the previous centroid
+    sums = np.add.reduceat(X[order], starts[non_empty], axis=0)
+    norms = np.linalg.norm(sums, axis=1)
+    norms[norms == 0] = 1
+    centroids = centroids.copy()
+    centroids[non_empty] = sums / norms[:, np.newaxis]
+  
+  assignments = assign_to_centroids(vectors, centroids)
+  rows = np.argsort(assignments, kind="stable")
+  offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+  
+  def write(tmp_path):
+    np.save(tmp_path + "centroids.npy", centroids.astype(np.float32))
+    np.save(tmp_path + "offsets.npy", offsets)
+    np.save(tmp_path + "rows.npy", rows)
+  
+  COM.write_directory_atomically(path, write)
@@ -0,0 +1,21 @@
+"""
+  Result of the stanfordnlp pipeline on a text, as used in the project:
+  the words of its first sentence (with text, upos, ...).
+
+  A SentencePOSTagger keeps the AnnotatedDocuments of the last texts it parsed,
+  so filtering, stemming and body part tagging of the same text share one parse.
+  The results derived from the words (e.g. the stemmed text) are memoized here too,
+  the documents are never built from the words of another text.
+"""
+
+
+class AnnotatedDocument:
+  
+  
+  def __init__(self, text, words):
+    self.text = text
+    self.words = words
+    # computed by SentencePOSTagger.stem_sentence the first time it is needed
+    self.stemmed_text = None
+    # tuple of admitted types => text computed by SentencePOSTagger.filter_unuseful_words_and_stem
+    self.filtered_stemmed_texts = {}
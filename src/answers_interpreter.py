@@ -1,5 +1,5 @@
 from body_part import BodyPart
-from sentence_pos_tagger import SentencePOSTagger
+from sentence_pos_tagger import get_default_sentence_pos_tagger
 import re
 
 
@@ -13,7 +13,7 @@ class AnswersInterpreter:
   
   def __init__(self, spt=None):
     if spt is None:
-      self.__spt = SentencePOSTagger()
+      self.__spt = get_default_sentence_pos_tagger()
     else:
       self.__spt = spt
   
@@ -22,17 +22,49 @@ class AnswersInterpreter:
     answers['type_question'] = 'answer text...'
   """
   def get_tokens_given_answers(self, answers, filter_unuseful_words=True):
-    tokens_symptoms = self.get_tokens_given_text(answers[SYMPTOMS])
+    text_symptoms, texts_bp = self.__get_texts_given_answers(answers)
+    
+    tokens_symptoms = self.get_tokens_given_text(text_symptoms)
     
     tokens_bp = []
+    for bp, text in texts_bp:
+      tokens = self.get_tokens_given_text(text, filter_unuseful_words)
+      tokens_bp.append((bp, tokens))
+    
+    return (tokens_symptoms, tokens_bp)
+  
+  
+  """
+  Given a list of answers dictionaries,
+  returns the list of the results of get_tokens_given_answers.
+  
+  The texts of all the answers are annotated in one call of the pipeline
+  (see SentencePOSTagger.annotate_texts) before being processed.
+  """
+  def get_tokens_given_list_answers(self, list_answers, filter_unuseful_words=True):
+    texts = []
+    for answers in list_answers:
+      text_symptoms, texts_bp = self.__get_texts_given_answers(answers)
+      texts.append(text_symptoms)
+      texts.extend(text for _, text in texts_bp)
+    self.__spt.annotate_texts(texts)
+    
+    return [self.get_tokens_given_answers(answers, filter_unuseful_words) for answers in list_answers]
+  
+  
+  """
+  Given the answers, returns the tuple (text of the symptoms, list of (body part, text of the body part))
+  with the texts from which the tokens are taken
+  """
+  def __get_texts_given_answers(self, answers):
+    texts_bp = []
     for key in answers.keys():
       if self.__is_problem_body_part_key(key):
         id_bp = self.__get_id_body_part_by_key(key)
         bp = BodyPart(id_bp)
-        tokens = self.get_tokens_given_text(answers[key] + " " + bp.names[0], filter_unuseful_words)
-        tokens_bp.append((bp, tokens))
+        texts_bp.append((bp, answers[key] + " " + bp.names[0]))
     
-    return (tokens_symptoms, tokens_bp)
+    return (answers[SYMPTOMS], texts_bp)
   
   
   """
@@ -65,6 +97,10 @@ class AnswersInterpreter:
                              answer_text,
                              filter_unuseful_words=True,
                              stemming=True):
+    # both steps on one parse of the answer text
+    if filter_unuseful_words and stemming:
+      return self.__spt.filter_unuseful_words_and_stem(answer_text)
+    
     # 1- delete unuseful words
     if filter_unuseful_words:
       answer_text = self.__spt.filter_unuseful_words(answer_text)
@@ -0,0 +1,86 @@
+import commons as COM
+import numpy as np
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from bert_serving.client import BertClient
+
+
+class BertClientPool:
+  
+  
+  """
+  Pool of connections to a bert server, with the same encode() of BertClient.
+  
+  A BertClient can't be shared between threads and waits for every request it sends,
+  so only one encode request is in flight per client. The pool keeps n_clients
+  connections and sends the batches of an encode call through all of them,
+  so several batches are in flight at the same time.
+  
+  No more than max_pending_batches batches are in flight: encode_async blocks
+  until a batch is done when the limit is reached (backpressure).
+  
+  batch_size: maximum number of sentences sent in one request
+  """
+  def __init__(self,
+               ip=COM.IP_BERT_SERVER,
+               port=COM.PORT_BERT_SERVER,
+               port_out=COM.PORT_OUT_BERT_SERVER,
+               n_clients=COM.DEFAULT_NUM_BERT_CLIENTS,
+               max_pending_batches=COM.DEFAULT_MAX_PENDING_BERT_BATCHES,
+               batch_size=COM.DEFAULT_BERT_BATCH_SIZE):
+    
+    if n_clients < 1 or max_pending_batches < 1 or batch_size < 1:
+      raise Exception("n_clients, max_pending_batches and batch_size must be >= 1")
+    
+    self.batch_size = batch_size
+    
+    self.__clients = queue.Queue()
+    for _ in range(n_clients):
+      self.__clients.put(BertClient(ip=ip, port=port, port_out=port_out, output_fmt="ndarray"))
+    
+    self.__executor = ThreadPoolExecutor(max_workers=n_clients)
+    self.__pending_batches = threading.BoundedSemaphore(max_pending_batches)
+  
+  
+  """
+  Send a batch of sentences to the server without waiting for the result.
+  Returns a Future of the matrix of the vectors.
+  """
+  def encode_async(self, texts):
+    self.__pending_batches.acquire()
+    
+    try:
+      future = self.__executor.submit(self.__encode_with_free_client, texts)
+    except Exception:
+      self.__pending_batches.release()
+      raise
+    
+    future.add_done_callback(lambda _: self.__pending_batches.release())
+    return future
+  
+  
+  """
+  Given a list of sentences, returns the matrix of their vectors
+  (the row i is the vector of the sentence i).
+  The sentences are sent in batches of batch_size, pipelined over the connections.
+  """
+  def encode(self, texts):
+    futures = [self.encode_async(texts[start:(start + self.batch_size)])
+               for start in range(0, len(texts), self.batch_size)]
+    
+    return np.concatenate([future.result() for future in futures])
+  
+  
+  def close(self):
+    self.__executor.shutdown(wait=True)
+    while not self.__clients.empty():
+      self.__clients.get().close()
+  
+  
+  def __encode_with_free_client(self, texts):
+    client = self.__clients.get()
+    try:
+      return client.encode(texts)
+    finally:
+      self.__clients.put(client)
@@ -0,0 +1,169 @@
+import commons as COM
+import hashlib
+import heapq
+import threading
+import time
+import numpy as np
+import zmq
+from zmq.utils import jsonapi
+from bert_serving.client import __version__ as BERT_SERVING_VERSION
+
+
+class BertStandInServer:
+  
+  
+  """
+  Local stand-in of a bert server, for testing and benchmarking offline.
+  
+  It speaks the protocol of bert-serving (BertClient and BertClientPool connect to it as
+  to a real server) but the vector of a sentence is a deterministic pseudo-random vector
+  seeded by the sentence text, so the same sentence has always the same vector.
+  
+  port: port where the requests of the clients are pulled
+  port_out: port where the results are published
+  dimension: dimension of the vectors
+  latency: seconds waited before answering a request, to simulate the network and the model.
+           Requests are delayed independently one from another
+  """
+  def __init__(self,
+               port=COM.PORT_BERT_SERVER,
+               port_out=COM.PORT_OUT_BERT_SERVER,
+               dimension=COM.DIMENSION_BERT_EMBEDDINGS,
+               latency=0,
+               max_seq_len=25):
+    self.port = port
+    self.port_out = port_out
+    self.dimension = dimension
+    self.latency = latency
+    self.max_seq_len = max_seq_len
+    
+    self.__stop_event = threading.Event()
+    self.__ready_event = threading.Event()
+    self.__thread = None
+  
+  
+  def start(self):
+    self.__stop_event.clear()
+    self.__thread = threading.Thread(target=self.__serve, daemon=True)
+    self.__thread.start()
+    self.__ready_event.wait()
+  
+  
+  def stop(self):
+    self.__stop_event.set()
+    if self.__thread is not None:
+      self.__thread.join()
+  
+  
+  def __enter__(self):
+    self.start()
+    return self
+  
+  
+  def __exit__(self, *args):
+    self.stop()
+  
+  
+  """
+  Deterministic vector of a sentence
+  """
+  def get_vector(self, text):
+    seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "little")
+    return np.random.RandomState(seed).standard_normal(self.dimension).astype(np.float32)
+  
+  
+  def __serve(self):
+    context = zmq.Context()
+    receiver = context.socket(zmq.PULL)
+    receiver.setsockopt(zmq.LINGER, 0)
+    receiver.bind("tcp://*:%d" % self.port)
+    # XPUB instead of PUB to know when a client has subscribed:
+    # an answer published before the subscription would be lost
+    sender = context.socket(zmq.XPUB)
+    sender.setsockopt(zmq.LINGER, 0)
+    sender.bind("tcp://*:%d" % self.port_out)
+    
+    poller = zmq.Poller()
+    poller.register(receiver, zmq.POLLIN)
+    poller.register(sender, zmq.POLLIN)
+    
+    self.__ready_event.set()
+    
+    # heap of (time of the answer, arrival order, answer)
+    answers = []
+    n_requests = 0
+    subscribed_clients = set()
+    # answers ready for clients not subscribed yet
+    waiting_answers = {}
+    
+    try:
+      while not self.__stop_event.is_set():
+        timeout = 100
+        if answers:
+          timeout = max(0, min(timeout, int((answers[0][0] - time.time()) * 1000)))
+        
+        events = dict(poller.poll(timeout))
+        
+        if sender in events:
+          # (un)subscription messages are b"\x01" (b"\x00") + client identity
+          subscription = sender.recv()
+          client_id = subscription[1:]
+          if subscription[:1] == b"\x01":
+            subscribed_clients.add(client_id)
+            for answer in waiting_answers.pop(client_id, []):
+              sender.send_multipart(answer)
+          else:
+            subscribed_clients.discard(client_id)
+        
+        if receiver in events:
+          request = receiver.recv_multipart()
+          heapq.heappush(answers, (time.time() + self.latency, n_requests, self.__answer(request)))
+          n_requests += 1
+        
+        while answers and answers[0][0] <= time.time():
+          answer = heapq.heappop(answers)[2]
+          if answer[0] in subscribed_clients:
+            sender.send_multipart(answer)
+          else:
+            waiting_answers.setdefault(answer[0], []).append(answer)
+    finally:
+      receiver.close()
+      sender.close()
+      context.term()
+  
+  
+  """
+  request: [client identity, message, request id, message length]
+  """
+  def __answer(self, request):
+    client_id, msg, req_id = request[0], request[1], request[2]
+    
+    if msg in (b"SHOW_CONFIG", b"SHOW_STATUS"):
+      return [client_id, jsonapi.dumps(self.__get_config()), req_id]
+    
+    texts = jsonapi.loads(msg)
+    # tokenized input is a list of lists of tokens
+    texts = [t if isinstance(t, str) else " ".join(t) for t in texts]
+    
+    matrix = np.array([self.get_vector(t) for t in texts], dtype=np.float32).reshape(len(texts), self.dimension)
+    arr_info = {"dtype": str(matrix.dtype), "shape": matrix.shape}
+    
+    return [client_id, jsonapi.dumps(arr_info), matrix.tobytes(), req_id]
+  
+  
+  def __get_config(self):
+    return {"server_version": BERT_SERVING_VERSION,
+            "max_seq_len": self.max_seq_len,
+            "show_tokens_to_client": False,
+            "dimension": self.dimension,
+            "stand_in": True}
+
+
+if __name__ == "__main__":
+  with BertStandInServer() as server:
+    print("Bert stand-in server listening on ports " + str(server.port) + ", " + str(server.port_out))
+    try:
+      while True:
+        time.sleep(1)
+    except KeyboardInterrupt:
+      pass
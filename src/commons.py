@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sklearn.metrics.pairwise as sk
 import numpy as np
+import os
+import shutil
 
 # --- PATHS ---
 BASEDIR = "/home/niksart/ParsingSymptomsThesis/"
@@ -18,6 +19,14 @@ DIMENSION_BERT_EMBEDDINGS = 768
 CSV_ST_CONCEPT_NAMES_BERT_PATH = CSV_BERT_PATH
 FILENAME_CSV_ST_CONCEPT_NAMES_BERT = "ST_concept_names.csv"
 IP_BERT_SERVER = "51.15.134.168"
+PORT_BERT_SERVER = 5555
+PORT_OUT_BERT_SERVER = 5556
+# maximum number of sentences sent to the bert server in one encode request
+DEFAULT_BERT_BATCH_SIZE = 256
+# number of connections to the bert server
+DEFAULT_NUM_BERT_CLIENTS = 4
+# maximum number of encode requests in flight (backpressure)
+DEFAULT_MAX_PENDING_BERT_BATCHES = 8
 
 CSV_ST_BODY_PARTS_TAGGING_PATH = CSV_PATH + "symptom_tree/body_parts_tagging.csv"
 CSV_BODY_PARTS_FILE = BASEDIR + "data/csv/hot_words/body_parts.csv"
@@ -25,6 +34,18 @@ CSV_BODY_PARTS_FILE = BASEDIR + "data/csv/hot_words/body_parts.csv"
 TXT_PATH = BASEDIR + "data/txt/"
 TXT_GLOVE_PATH = TXT_PATH + "glove/"
 
+NPY_PATH = BASEDIR + "data/npy/"
+NPY_GLOVE_PATH = NPY_PATH + "glove/"
+NPY_ST_CONCEPT_NAMES_PATH = NPY_PATH + "symptom_tree/concept_names/"
+
+PICKLE_PATH = BASEDIR + "data/pickle/"
+PICKLE_SYMPTOM_TREE_PATH = PICKLE_PATH + "symptom_tree.pickle"
+PICKLE_TOKEN_MEMO_PATH = PICKLE_PATH + "token_memo/"
+PICKLE_STEM_TABLE_PATH = PICKLE_PATH + "glove_stem_table.pickle"
+
+SQLITE_PATH = BASEDIR + "data/sqlite/"
+SQLITE_EMBEDDING_CACHE = SQLITE_PATH + "embedding_cache.sqlite"
+
 JSON_FILE_QUESTIONS_QA = BASEDIR + "data/json/qa_questions.json"
 JSON_SYMPTOM_TREE_PATH = BASEDIR + "data/json/symptom_tree.json"
 JSON_FILE_QASYSTEM_RNET_EVAL_TO_TAG = BASEDIR + "data/json/results_qa_evaluation/sentences_and_tokens_for_pred_RNET_to_tag.json"
@@ -53,6 +74,61 @@ POSSIBLE_GLOVE_DIMENSIONS = [50, 100, 200, 300]
 DEFAULT_GLOVE_DIMENSION = 1 # index of the possible dimensions list
 
 
+# --- SUBSENTENCES SETTINGS ---
+# power_set: all the subsets of the words of a token
+# max_size: subsets made of at most max_subset_size words
+# spans: contiguous spans of words (n-grams)
+SUBSENTENCE_STRATEGIES = ["power_set", "max_size", "spans"]
+DEFAULT_SUBSENTENCE_STRATEGY = 0 # index of the strategies list
+DEFAULT_MAX_SUBSET_SIZE = 3
+# hard ceiling on the number of subsentences generated for a token, None => no ceiling
+MAX_SUBSENTENCES_PER_TOKEN = None
+
+
+# --- QUANTIZATION SETTINGS ---
+QUANTIZATION_MODES = ["float16", "int8"]
+# number of best concept names per subsentence re-scored at full precision
+DEFAULT_RERANK_CANDIDATES = 10
+# rows dequantized at a time when multiplying a quantized matrix
+QUANTIZATION_BLOCK_SIZE = 4096
+
+
+# --- APPROXIMATE SEARCH SETTINGS ---
+# number of lists of the IVF index closest to a query whose concept names are scored
+DEFAULT_IVF_PROBES = 8
+IVF_KMEANS_ITERATIONS = 10
+# maximum number of concept names used to train the centroids
+IVF_KMEANS_SAMPLE_SIZE = 100000
+# rows assigned to the centroids at a time
+IVF_BLOCK_SIZE = 4096
+# subtrees kept at each level of the hierarchical search
+DEFAULT_BEAM_WIDTH = 4
+# subsentences scored at a time by the batch search
+SEARCH_BLOCK_SIZE = 1024
+# best matches of (token, body part) memoized by a SymptomTree
+DEFAULT_TOKEN_MEMO_ENTRIES = 100000
+# changed when the results of the search change for the same settings,
+# so that the memos saved by the previous versions are not loaded
+TOKEN_MEMO_VERSION = 3
+
+
+# --- STEMMING SETTINGS ---
+# stems of the words that are not GloVe words memoized by a SentencePOSTagger
+DEFAULT_STEM_MEMO_ENTRIES = 100000
+# texts whose AnnotatedDocument (result of the stanfordnlp pipeline) is kept by a SentencePOSTagger
+DEFAULT_ANNOTATION_CACHE_ENTRIES = 10000
+# sentences of the testing set annotated together by the Predictor
+# (their texts and the texts of their answers stay in the cache above)
+ANNOTATION_BATCH_SIZE = 256
+
+
+# --- EMBEDDING CACHE SETTINGS ---
+DEFAULT_EMBEDDING_CACHE_MEMORY_ENTRIES = 100000
+DEFAULT_EMBEDDING_CACHE_DISK_ENTRIES = 2000000
+# texts looked up in the database with one query
+EMBEDDING_CACHE_QUERY_SIZE = 500
+
+
 def strip_string(s):
     ret = ""
     for c in s:
@@ -65,15 +141,108 @@ def strip_string(s):
 
 
 """
-Similarity between two matrices
-
-A is #examplesA x #features
-B is #examplesB x #features
-
+Similarity between two matrices A and B, given the dot products A B^T
+and the norms of the rows of A and of B
 """
-def similarity_matrices(A, B):
+def similarity_given_dot_products(dot_products, norms_A, norms_B):
   if SIMILARITY_MEASURE_SUPPORTED[SIMILARITY_MEASURE] == "cosine":
-    return sk.cosine_similarity(A, B)
+    denominators = np.outer(norms_A, norms_B)
+    denominators[denominators == 0] = 1
+    return dot_products / denominators
   elif SIMILARITY_MEASURE_SUPPORTED[SIMILARITY_MEASURE] == "euclidean":
-    euclidean_distances = sk.euclidean_distances(A, B)
+    squared_distances = np.add.outer(norms_A ** 2, norms_B ** 2) - 2 * dot_products
+    euclidean_distances = np.sqrt(np.maximum(squared_distances, 0))
     return np.power(np.e, - euclidean_distances)
+
+
+"""
+Returns the k columns with the highest similarity of each row of the similarity matrix:
+  - indexes: #rows x k matrix of the columns, ordered by decreasing similarity
+  - similarities: #rows x k matrix of their similarities
+k is reduced to the number of columns if greater
+"""
+def get_top_k(similarity_matrix, k):
+  k = min(k, similarity_matrix.shape[1])
+  
+  if k < similarity_matrix.shape[1]:
+    indexes = np.argpartition(-similarity_matrix, k - 1, axis=1)[:, :k]
+  else:
+    indexes = np.tile(np.arange(k), (similarity_matrix.shape[0], 1))
+  similarities = np.take_along_axis(similarity_matrix, indexes, axis=1)
+  
+  order = np.argsort(-similarities, axis=1, kind="stable")
+  return np.take_along_axis(indexes, order, axis=1), np.take_along_axis(similarities, order, axis=1)
+
+
+"""
+Suffix of the results file names with the search settings that differ from the defaults
+(empty with the defaults, so the names of the results computed before don't change).
+Used by the Predictor to write the results and by the Evaluator to find them
+"""
+def get_search_settings_suffix(subsentence_strategy=SUBSENTENCE_STRATEGIES[DEFAULT_SUBSENTENCE_STRATEGY],
+                               max_subset_size=DEFAULT_MAX_SUBSET_SIZE,
+                               max_subsentences=MAX_SUBSENTENCES_PER_TOKEN,
+                               quantization=None,
+                               use_ann=False,
+                               ann_probes=DEFAULT_IVF_PROBES,
+                               use_hierarchical_search=False,
+                               beam_width=DEFAULT_BEAM_WIDTH):
+  suffix = ""
+  
+  if subsentence_strategy != SUBSENTENCE_STRATEGIES[DEFAULT_SUBSENTENCE_STRATEGY]:
+    suffix += "-" + subsentence_strategy
+  if max_subset_size != DEFAULT_MAX_SUBSET_SIZE:
+    suffix += "-max_subset" + str(max_subset_size)
+  if max_subsentences != MAX_SUBSENTENCES_PER_TOKEN:
+    suffix += "-max_subsentences" + str(max_subsentences)
+  if quantization is not None:
+    suffix += "-" + quantization
+  if use_ann:
+    suffix += "-ann" + str(ann_probes)
+  if use_hierarchical_search:
+    suffix += "-beam" + str(beam_width)
+  
+  return suffix
+
+
+"""
+Write the file path atomically: write(tmp_path) writes it in a temporary file,
+which is then renamed to path, so that other processes never read a partial file
+"""
+def write_file_atomically(path, write):
+  tmp_path = path + "." + str(os.getpid())
+  write(tmp_path)
+  os.replace(tmp_path, path)
+
+
+"""
+Write the directory path (ending with "/") atomically: write(tmp_path) fills a temporary
+directory, which then takes the place of path.
+
+A directory can't be replaced in one step: the old one is renamed aside first,
+so path is missing only between two renames (not while the old one is deleted).
+If another process puts its own directory in path meanwhile, it is kept and
+the temporary directory is deleted: both have been built from the same data.
+"""
+def write_directory_atomically(path, write):
+  path = path.rstrip("/")
+  tmp_path = path + "." + str(os.getpid())
+  old_path = path + ".old." + str(os.getpid())
+  
+  os.makedirs(tmp_path, exist_ok=True)
+  write(tmp_path + "/")
+  
+  try:
+    os.rename(path, old_path)
+  except FileNotFoundError:
+    # not built yet, or renamed aside by another process
+    old_path = None
+  
+  try:
+    os.rename(tmp_path, path)
+  except OSError:
+    # ENOTEMPTY / EEXIST: another process renamed its directory in path first
+    shutil.rmtree(tmp_path, ignore_errors=True)
+  
+  if old_path is not None:
+    shutil.rmtree(old_path, ignore_errors=True)
@@ -0,0 +1,262 @@
+import commons as COM
+import json
+import numpy as np
+
+
+"""
+  Compact representation of the symptom tree, backed by arrays instead of one object per node.
+  
+  Nodes are numbered in pre-order, so the subtree of the node i takes the positions
+  [i, i + subtree_sizes[i]). For each position:
+    - parents, first_children, next_siblings: positions of the related nodes, -1 if none
+    - depths: distance from the root
+    - cui_ids: index of the CUI of the node in cuis (CUIs are interned, a CUI can appear
+      in more positions)
+    - concept_names: concept name as in the json, normalized_concept_names: the same
+      normalized with COM.strip_string (computed once)
+  
+  The nodes of the CUI cui_id are the positions cui_positions[cui_offsets[cui_id]:cui_offsets[cui_id+1]],
+  sorted.
+  
+  NodeView gives the node-like API (name, concept_name, children, ...) over a position.
+"""
+
+
+class CompactTree:
+  
+  
+  """
+  cuis_list, concept_names and parents are lists parallel to the nodes in pre-order
+  """
+  def __init__(self, cuis_list, concept_names, parents):
+    n = len(parents)
+    
+    self.cuis, cui_ids = np.unique(np.array(cuis_list, dtype=str), return_inverse=True)
+    self.cui_ids = cui_ids.astype(np.int32)
+    self.concept_names = list(concept_names)
+    self.normalized_concept_names = [COM.strip_string(concept_name) for concept_name in concept_names]
+    
+    # the arrays are filled as lists, indexing numpy arrays one element at a time is slow
+    first_children = [-1] * n
+    next_siblings = [-1] * n
+    subtree_sizes = [1] * n
+    # backwards, so the children are linked in pre-order and the sizes are accumulated bottom-up
+    for i in range(n - 1, 0, -1):
+      parent = parents[i]
+      next_siblings[i] = first_children[parent]
+      first_children[parent] = i
+      subtree_sizes[parent] += subtree_sizes[i]
+    
+    depths = [0] * n
+    for i in range(1, n):
+      depths[i] = depths[parents[i]] + 1
+    
+    self.parents = np.array(parents, dtype=np.int32)
+    self.first_children = np.array(first_children, dtype=np.int32)
+    self.next_siblings = np.array(next_siblings, dtype=np.int32)
+    self.subtree_sizes = np.array(subtree_sizes, dtype=np.int32)
+    self.depths = np.array(depths, dtype=np.int32)
+    
+    self.cui_positions = np.argsort(self.cui_ids, kind="stable").astype(np.int32)
+    self.cui_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.cui_ids, minlength=len(self.cuis)))])
+    
+    self.__build_lookups()
+  
+  
+  def __len__(self):
+    return len(self.parents)
+  
+  
+  # the lookup dictionaries are rebuilt after unpickling instead of being saved
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state["_CompactTree__cui_id_by_cui"]
+    del state["_CompactTree__position_by_concept_name"]
+    return state
+  
+  
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.__build_lookups()
+  
+  
+  def __build_lookups(self):
+    self.__cui_id_by_cui = {cui: cui_id for cui_id, cui in enumerate(self.cuis)}
+    
+    # the first position, if the concept name is repeated
+    self.__position_by_concept_name = {}
+    for position, concept_name in enumerate(self.normalized_concept_names):
+      self.__position_by_concept_name.setdefault(concept_name, position)
+  
+  
+  def get_node(self, position):
+    return NodeView(self, position)
+  
+  
+  def get_cui(self, position):
+    return self.cuis[self.cui_ids[position]]
+  
+  
+  """
+  Returns the sorted positions of the nodes with that CUI
+  """
+  def get_positions_by_cui(self, cui):
+    cui_id = self.__cui_id_by_cui.get(cui)
+    if cui_id is None:
+      return self.cui_positions[:0]
+    
+    return self.cui_positions[self.cui_offsets[cui_id]:self.cui_offsets[cui_id + 1]]
+  
+  
+  """
+  Returns the position of the node with that normalized concept name, None if not in the tree
+  """
+  def get_position_by_concept_name(self, normalized_concept_name):
+    return self.__position_by_concept_name.get(normalized_concept_name)
+  
+  
+  def get_children_positions(self, position):
+    children = []
+    child = self.first_children[position]
+    while child != -1:
+      children.append(child)
+      child = self.next_siblings[child]
+    
+    return children
+  
+  
+  """
+  Returns True if a node with CUI cui is in the subtree of the first node with CUI root_cui,
+  False if root_cui is not in the tree
+  """
+  def is_in_subtree(self, cui, root_cui):
+    root_positions = self.get_positions_by_cui(root_cui)
+    if len(root_positions) == 0:
+      return False
+    
+    enter = root_positions[0]
+    exit = enter + self.subtree_sizes[enter]
+    
+    positions = self.get_positions_by_cui(cui)
+    i = np.searchsorted(positions, enter)
+    
+    return i < len(positions) and positions[i] < exit
+  
+  
+  """
+  Returns the tree drawn as anytree.RenderTree with ContStyle does, one line per node
+  """
+  def render(self, position=0):
+    lines = []
+    # (position, prefix of the children lines, prefix of the line of the node)
+    stack = [(position, "", "")]
+    while stack:
+      position, prefix, line_prefix = stack.pop()
+      lines.append(line_prefix + repr(self.get_node(position)))
+      
+      children = self.get_children_positions(position)
+      for i in range(len(children) - 1, -1, -1):
+        last = i == len(children) - 1
+        stack.append((children[i],
+                      prefix + ("    " if last else "│   "),
+                      prefix + ("└── " if last else "├── ")))
+    
+    return "\n".join(lines)
+
+
+
+class NodeView:
+  
+  
+  """
+  Thin view of the node in position of a CompactTree, with the API of the anytree nodes
+  used in the project. Two views are equal if their normalized concept names are equal.
+  """
+  __slots__ = ("tree", "position")
+  
+  def __init__(self, tree, position):
+    self.tree = tree
+    self.position = position
+  
+  
+  @property
+  def name(self):
+    return self.tree.get_cui(self.position)
+  
+  
+  @property
+  def concept_name(self):
+    return self.tree.concept_names[self.position]
+  
+  
+  # concept_name identifies univoquely the node
+  def get_concept_name(self):
+    return self.tree.normalized_concept_names[self.position]
+  
+  
+  @property
+  def parent(self):
+    parent = self.tree.parents[self.position]
+    return None if parent == -1 else NodeView(self.tree, parent)
+  
+  
+  @property
+  def children(self):
+    return tuple(NodeView(self.tree, child) for child in self.tree.get_children_positions(self.position))
+  
+  
+  @property
+  def is_leaf(self):
+    return self.tree.first_children[self.position] == -1
+  
+  
+  @property
+  def depth(self):
+    return int(self.tree.depths[self.position])
+  
+  
+  @property
+  def path(self):
+    path = []
+    node = self
+    while node is not None:
+      path.append(node)
+      node = node.parent
+    
+    return tuple(reversed(path))
+  
+  
+  def __eq__(self, other):
+    return isinstance(other, NodeView) and self.get_concept_name() == other.get_concept_name()
+  
+  
+  def __hash__(self):
+    return hash(self.get_concept_name())
+  
+  
+  def __repr__(self):
+    return "Node(" + repr("/" + "/".join(node.name for node in self.path)) + \
+           ", concept_name=" + repr(self.concept_name) + ")"
+
+
+"""
+Returns the CompactTree of the symptom tree json (as exported by anytree's JsonExporter)
+"""
+def import_compact_tree(symptom_json):
+  cuis_list = []
+  concept_names = []
+  parents = []
+  
+  # (json node, position of the parent), visited in pre-order
+  stack = [(json.loads(symptom_json), -1)]
+  while stack:
+    json_node, parent = stack.pop()
+    position = len(parents)
+    cuis_list.append(json_node["name"])
+    concept_names.append(json_node["concept_name"])
+    parents.append(parent)
+    
+    for json_child in reversed(json_node.get("children", [])):
+      stack.append((json_child, position))
+  
+  return CompactTree(cuis_list, concept_names, parents)
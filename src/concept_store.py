@@ -0,0 +1,220 @@
+import commons as COM
+import hashlib
+import numpy as np
+import os
+
+
+"""
+  Store of the vectors of the concept names of the symptom tree.
+  
+  A store is a directory with these files:
+    - vectors.npy: float32 matrix #concept_names x d, rows L2-normalized
+    - norms.npy: norms of the rows before the normalization (needed by the euclidean similarity)
+    - concept_names.npy: concept name of each row
+    - cuis.npy: CUI of each row
+    - hashes.npy: content hash of each row (see get_content_hash)
+    - unvectorized_hashes.npy: content hashes of the concept names that can't be vectorified
+    - tree_hash.txt: hash of the symptom tree json the store was built from
+  
+  vectors.npy is memory-mapped when loaded. Each store is loaded once per process.
+"""
+
+# path => ConceptStore
+loaded_stores = {}
+
+
+class ConceptStore:
+  
+  
+  def __init__(self, vectors, norms, concept_names, cuis, hashes, unvectorized_hashes, tree_hash):
+    self.vectors = vectors
+    self.norms = norms
+    self.concept_names = concept_names
+    self.cuis = cuis
+    self.hashes = hashes
+    self.unvectorized_hashes = unvectorized_hashes
+    self.tree_hash = tree_hash
+    self.d = vectors.shape[1]
+  
+  
+  def __len__(self):
+    return len(self.cuis)
+  
+  
+  """
+  Returns the original (not normalized) vectors of the rows
+  """
+  def get_full_vectors(self, rows):
+    return self.vectors[rows] * self.norms[rows][:, np.newaxis]
+  
+  
+  """
+  Given the dot products between the rows of A and the normalized vectors of rows,
+  returns the similarity matrix between A and the concept names of rows
+  """
+  def get_similarity_given_dot_products(self, dot_products, A, rows=None):
+    norms_A = np.linalg.norm(A, axis=1)
+    
+    if COM.SIMILARITY_MEASURE_SUPPORTED[COM.SIMILARITY_MEASURE] == "cosine":
+      norms_A[norms_A == 0] = 1
+      return dot_products / norms_A[:, np.newaxis]
+    else:
+      norms_B = self.norms if rows is None else self.norms[rows]
+      return COM.similarity_given_dot_products(dot_products * norms_B, norms_A, norms_B)
+  
+  
+  """
+  Similarity matrix between A (#examplesA x d) and the concept names of rows
+  (all the concept names if rows is None).
+  B can be passed if the vectors of rows have already been sliced from the store.
+  """
+  def similarity(self, A, rows=None, B=None):
+    A = np.asarray(A, dtype=np.float32)
+    if B is None:
+      B = self.vectors if rows is None else self.vectors[rows]
+    
+    return self.get_similarity_given_dot_products(A @ B.T, A, rows)
+
+
+"""
+Hash of the content of a row: a row has to be vectorified again when it changes
+"""
+def get_content_hash(cui, concept_name, internal_representation, dimension):
+  content = "|".join([cui, concept_name, internal_representation, str(dimension)])
+  return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def get_content_hashes(cuis, concept_names, internal_representation, dimension):
+  return [get_content_hash(cui, concept_name, internal_representation, dimension)
+          for cui, concept_name in zip(cuis, concept_names)]
+
+
+def get_concept_store_path(internal_representation, dimension):
+  return COM.NPY_ST_CONCEPT_NAMES_PATH + internal_representation + str(dimension) + "d/"
+
+
+def exists_concept_store(path):
+  return os.path.isfile(path + "cuis.npy")
+
+
+"""
+Stores saved without hashes can't be updated incrementally:
+their hashes are None and their tree_hash is empty
+"""
+def load_concept_store(path):
+  if path not in loaded_stores:
+    if os.path.isfile(path + "hashes.npy"):
+      hashes = np.load(path + "hashes.npy")
+      unvectorized_hashes = np.load(path + "unvectorized_hashes.npy")
+      with open(path + "tree_hash.txt") as f:
+        tree_hash = f.read()
+    else:
+      hashes = None
+      unvectorized_hashes = None
+      tree_hash = ""
+    
+    loaded_stores[path] = ConceptStore(np.load(path + "vectors.npy", mmap_mode="r"),
+                                       np.load(path + "norms.npy"),
+                                       np.load(path + "concept_names.npy"),
+                                       np.load(path + "cuis.npy"),
+                                       hashes,
+                                       unvectorized_hashes,
+                                       tree_hash)
+  
+  return loaded_stores[path]
+
+
+"""
+Normalize the matrix of the vectors (the row i is the vector of concept_names[i], cuis[i],
+whose content hash is hashes[i]) and save the store in path
+"""
+def save_concept_store(path, concept_names, cuis, matrix, hashes, unvectorized_hashes=[], tree_hash=""):
+  matrix = np.asarray(matrix, dtype=np.float32)
+  norms = np.linalg.norm(matrix, axis=1)
+  
+  safe_norms = norms.copy()
+  safe_norms[safe_norms == 0] = 1
+  
+  def write(tmp_path):
+    np.save(tmp_path + "vectors.npy", matrix / safe_norms[:, np.newaxis])
+    np.save(tmp_path + "norms.npy", norms)
+    np.save(tmp_path + "concept_names.npy", np.array(concept_names, dtype=str))
+    np.save(tmp_path + "cuis.npy", np.array(cuis, dtype=str))
+    np.save(tmp_path + "hashes.npy", np.array(hashes, dtype=str))
+    np.save(tmp_path + "unvectorized_hashes.npy", np.array(unvectorized_hashes, dtype=str))
+    with open(tmp_path + "tree_hash.txt", "w") as f:
+      f.write(tree_hash)
+  
+  COM.write_directory_atomically(path, write)
+  
+  loaded_stores.pop(path, None)
+
+
+"""
+Bulk builder of a store: given the parallel lists concept_names and cuis
+(e.g. of all the nodes of the symptom tree, built from the json whose hash is tree_hash),
+the distinct concept names are stemmed and vectorified in batches by the Vectorifier,
+and the store is saved in one go.
+
+If a store exists yet in path, only the rows whose content hash is not in it
+(added or changed nodes) are vectorified, the others are copied from it.
+Rows of the old store that are not in the lists anymore are dropped.
+
+Concept names that can't be vectorified are not in the store.
+"""
+def build_concept_store(path, concept_names, cuis, vectorifier, tree_hash=""):
+  hashes = get_content_hashes(cuis, concept_names, vectorifier.internal_representation, vectorifier.d)
+  
+  old_rows = {}
+  old_unvectorized_hashes = set()
+  if exists_concept_store(path):
+    old_store = load_concept_store(path)
+    if old_store.hashes is not None:
+      old_rows = {h: i for i, h in enumerate(old_store.hashes)}
+      old_unvectorized_hashes = set(old_store.unvectorized_hashes)
+  
+  new_concept_names = list(dict.fromkeys(c for c, h in zip(concept_names, hashes)
+                                         if h not in old_rows and h not in old_unvectorized_hashes))
+  
+  print(str(len(new_concept_names)) + " concept names to vectorize, " + \
+        str(len(set(hashes) & set(old_rows))) + " reused")
+  
+  new_matrix, new_vectorized = vectorifier.vectorize_concept_names(new_concept_names)
+  new_positions = {concept_name: i for i, concept_name in enumerate(new_concept_names)}
+  
+  store_concept_names = []
+  store_cuis = []
+  store_hashes = []
+  unvectorized_hashes = []
+  # (row in the new store, row in the old store or in new_matrix)
+  rows_from_old_store = []
+  rows_from_new_matrix = []
+  
+  for concept_name, cui, h in zip(concept_names, cuis, hashes):
+    if h in old_rows:
+      rows_from_old_store.append((len(store_hashes), old_rows[h]))
+    elif h not in old_unvectorized_hashes and new_vectorized[new_positions[concept_name]]:
+      rows_from_new_matrix.append((len(store_hashes), new_positions[concept_name]))
+    else:
+      unvectorized_hashes.append(h)
+      continue
+    
+    store_concept_names.append(concept_name)
+    store_cuis.append(cui)
+    store_hashes.append(h)
+  
+  matrix = np.zeros((len(store_hashes), vectorifier.d), dtype=np.float32)
+  if rows_from_old_store != []:
+    store_rows, old_store_rows = zip(*rows_from_old_store)
+    matrix[list(store_rows)] = old_store.get_full_vectors(np.array(old_store_rows))
+  if rows_from_new_matrix != []:
+    store_rows, new_matrix_rows = zip(*rows_from_new_matrix)
+    matrix[list(store_rows)] = new_matrix[list(new_matrix_rows)]
+  
+  save_concept_store(path,
+                     store_concept_names,
+                     store_cuis,
+                     matrix,
+                     store_hashes,
+                     list(dict.fromkeys(unvectorized_hashes)),
+                     tree_hash)
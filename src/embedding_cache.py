@@ -0,0 +1,153 @@
+import commons as COM
+import numpy as np
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+  
+  
+  """
+  Persistent cache of the vectors of (stemmed) texts, in front of the Vectorifier.
+  
+  Vectors are keyed by (representation, dimension, text) and kept in two layers:
+    - an in-memory LRU of at most max_memory_entries vectors
+    - a SQLite database at path, of at most max_disk_entries vectors:
+      when it is full the least recently used vectors are deleted
+  
+  The database is shared by all the runs (and processes) using the same path,
+  so representation must identify all the settings the vectors depend on
+  (see Vectorifier). Each call reads or writes the database in one transaction.
+  """
+  def __init__(self,
+               path=COM.SQLITE_EMBEDDING_CACHE,
+               max_memory_entries=COM.DEFAULT_EMBEDDING_CACHE_MEMORY_ENTRIES,
+               max_disk_entries=COM.DEFAULT_EMBEDDING_CACHE_DISK_ENTRIES):
+    
+    if max_memory_entries < 0 or max_disk_entries < 1:
+      raise Exception("max_memory_entries must be >= 0 and max_disk_entries >= 1")
+    
+    self.max_memory_entries = max_memory_entries
+    self.max_disk_entries = max_disk_entries
+    
+    self.__memory = OrderedDict()
+    
+    directory = os.path.dirname(path)
+    if directory != "":
+      os.makedirs(directory, exist_ok=True)
+    
+    self.__db = sqlite3.connect(path)
+    self.__db.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                      "representation TEXT, dimension INTEGER, text TEXT, "
+                      "vector BLOB, last_used REAL, "
+                      "PRIMARY KEY (representation, dimension, text))")
+    self.__db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+    self.__db.commit()
+  
+  
+  """
+  Returns the vector of the text, or None if it is not in the cache
+  """
+  def get(self, representation, dimension, text):
+    return self.get_many(representation, dimension, [text]).get(text)
+  
+  
+  """
+  Returns a dictionary text => vector with the texts found in the cache
+  """
+  def get_many(self, representation, dimension, texts):
+    found = {}
+    missing = []
+    
+    for text in texts:
+      key = (representation, dimension, text)
+      if key in self.__memory:
+        self.__memory.move_to_end(key)
+        found[text] = self.__memory[key]
+      else:
+        missing.append(text)
+    
+    if missing == []:
+      return found
+    
+    missing = list(dict.fromkeys(missing))
+    found_on_disk = []
+    # one query for each chunk of texts, SQLite limits the number of parameters
+    for start in range(0, len(missing), COM.EMBEDDING_CACHE_QUERY_SIZE):
+      chunk = missing[start:(start + COM.EMBEDDING_CACHE_QUERY_SIZE)]
+      rows = self.__db.execute("SELECT text, vector FROM embeddings "
+                               "WHERE representation = ? AND dimension = ? AND text IN (" + \
+                               ", ".join("?" * len(chunk)) + ")",
+                               [representation, dimension] + chunk).fetchall()
+      for text, blob in rows:
+        vector = np.frombuffer(blob, dtype=np.float32)
+        found[text] = vector
+        found_on_disk.append(text)
+        self.__put_in_memory((representation, dimension, text), vector)
+    
+    if found_on_disk != []:
+      now = time.time()
+      self.__db.executemany("UPDATE embeddings SET last_used = ? "
+                            "WHERE representation = ? AND dimension = ? AND text = ?",
+                            [(now, representation, dimension, text) for text in found_on_disk])
+      self.__db.commit()
+    
+    return found
+  
+  
+  def put(self, representation, dimension, text, vector):
+    self.put_many(representation, dimension, {text: vector})
+  
+  
+  """
+  vectors: dictionary text => vector
+  """
+  def put_many(self, representation, dimension, vectors):
+    if len(vectors) == 0:
+      return
+    
+    now = time.time()
+    
+    rows = []
+    for text, vector in vectors.items():
+      vector = np.asarray(vector, dtype=np.float32)
+      self.__put_in_memory((representation, dimension, text), vector)
+      rows.append((representation, dimension, text, vector.tobytes(), now))
+    
+    self.__db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+    
+    # counted in the same transaction, other processes may have written too
+    n_disk_entries = self.__db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    if n_disk_entries > self.max_disk_entries:
+      self.__evict_from_disk(n_disk_entries)
+    
+    self.__db.commit()
+  
+  
+  def close(self):
+    self.__db.close()
+  
+  
+  def __put_in_memory(self, key, vector):
+    if self.max_memory_entries == 0:
+      return
+    
+    self.__memory[key] = vector
+    self.__memory.move_to_end(key)
+    
+    while len(self.__memory) > self.max_memory_entries:
+      self.__memory.popitem(last=False)
+  
+  
+  """
+  Delete the least recently used vectors, leaving 10% of free space
+  so that the eviction does not run at every insertion
+  """
+  def __evict_from_disk(self, n_disk_entries):
+    n_to_delete = n_disk_entries - int(self.max_disk_entries * 0.9)
+    
+    self.__db.execute("DELETE FROM embeddings WHERE rowid IN "
+                      "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                      (n_to_delete,))
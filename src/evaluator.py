@@ -15,7 +15,15 @@ class Evaluator:
                pruning,
                min_similarity,
                filter_unuseful_words,
-               glove_dimension=None):
+               glove_dimension=None,
+               subsentence_strategy=COM.SUBSENTENCE_STRATEGIES[COM.DEFAULT_SUBSENTENCE_STRATEGY],
+               max_subset_size=COM.DEFAULT_MAX_SUBSET_SIZE,
+               max_subsentences=COM.MAX_SUBSENTENCES_PER_TOKEN,
+               quantization=None,
+               use_ann=False,
+               ann_probes=COM.DEFAULT_IVF_PROBES,
+               use_hierarchical_search=False,
+               beam_width=COM.DEFAULT_BEAM_WIDTH):
     
     # qa_system must be in the list
     if qa_system not in COM.QA_SYSTEM_TYPES:
@@ -48,7 +56,15 @@ class Evaluator:
                ("search_bp" if search_for_body_parts else "no_search_bp") + "-" + \
                ("pruning" if pruning else "no_pruning") + "-" + \
                "min_sim" + str(min_similarity) + "-" + \
-               ("filter_words" if filter_unuseful_words else "no_filter_words")
+               ("filter_words" if filter_unuseful_words else "no_filter_words") + \
+               COM.get_search_settings_suffix(subsentence_strategy,
+                                              max_subset_size,
+                                              max_subsentences,
+                                              quantization,
+                                              use_ann,
+                                              ann_probes,
+                                              use_hierarchical_search,
+                                              beam_width)
                
     extension = ".json"
     self.__filename_evaluated = filename + "-EVALUATED" + extension
@@ -76,8 +92,8 @@ class Evaluator:
       cui_predictions = prediction["cui_predictions"]
       real_cuis = prediction["real_cuis"]
       
-      # List of subtrees: each subtree is a list of cuis
-      real_cuis_expanded = self.__expand_real_cuis(real_cuis)
+      # List of subtrees: each subtree is identified by the cui of its root
+      real_cuis_expanded = list(real_cuis)
       subtrees_taken_yet = []
       
       # for each cui prediction
@@ -90,7 +106,7 @@ class Evaluator:
           # if I've not found yet the matching
           if found_match == False:
             # if the cui is in this subtree
-            if pred_cui in subtree:
+            if self.__st_light.is_in_subtree(pred_cui, subtree):
               correct_cuis += 1
               # the subtree has to be removed because the associated symptom is gone
               real_cuis_expanded.remove(subtree)
@@ -101,7 +117,7 @@ class Evaluator:
         # infatti se così fosse non è sbagliato, è solo una previsione ridondante (meno grave)
         for subtree_taken_yet in subtrees_taken_yet:
           if found_match == False:
-            if pred_cui in subtree_taken_yet:
+            if self.__st_light.is_in_subtree(pred_cui, subtree_taken_yet):
               correct_redundant_cuis += 1
               found_match = True
         
@@ -166,14 +182,3 @@ class Evaluator:
       print("Successfully saved statistics file.")
     
     return ret
-  
-  
-  def __expand_real_cuis(self, real_cuis):
-    ret = []
-    for cui in real_cuis:
-      cuis = self.__st_light.get_cuis_subtree_given_cui_root(cui)
-      ret.append(cuis)
-    
-    return ret
-      
-      
\ No newline at end of file
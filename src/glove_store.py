@@ -0,0 +1,86 @@
+import commons as COM
+import numpy as np
+import os
+
+
+"""
+  Binary store of the GloVe vectors.
+  
+  For each dimension the store is made of two files:
+    - glove.6B.<d>d.vocab.txt: one word per line, ordered by frequency as in GloVe
+    - glove.6B.<d>d.npy: float32 matrix, the row i is the vector of the word at line i
+  
+  The matrix is memory-mapped when loaded, so it is read lazily from the page cache
+  (shared between the processes on the same host) instead of being parsed every time.
+"""
+
+
+def get_vocabulary_path(dimension):
+  return COM.NPY_GLOVE_PATH + "glove.6B." + str(dimension) + "d.vocab.txt"
+
+
+def get_matrix_path(dimension):
+  return COM.NPY_GLOVE_PATH + "glove.6B." + str(dimension) + "d.npy"
+
+
+def exists_glove_store(dimension):
+  return os.path.isfile(get_vocabulary_path(dimension)) and \
+         os.path.isfile(get_matrix_path(dimension))
+
+
+"""
+Convert the GloVe text file of the given dimension into the binary store.
+Only the first COM.MAX_NUM_IMPORTED_GLOVE_VECTORS words are converted.
+"""
+def save_glove_store(dimension):
+  if dimension not in COM.POSSIBLE_GLOVE_DIMENSIONS:
+    raise Exception("Dimension_glove_vector should be 50 or 100 or 200 or 300")
+  
+  os.makedirs(COM.NPY_GLOVE_PATH, exist_ok=True)
+  
+  matrix = np.zeros((COM.MAX_NUM_IMPORTED_GLOVE_VECTORS, dimension), dtype=np.float32)
+  words = []
+  
+  with open(COM.TXT_GLOVE_PATH + "glove.6B." + str(dimension) + "d.txt", encoding="utf-8") as f:
+    for line in f:
+      if len(words) == COM.MAX_NUM_IMPORTED_GLOVE_VECTORS:
+        break
+      
+      values = line.rstrip("\n").split(" ")
+      matrix[len(words)] = np.array(values[1:(dimension + 1)], dtype=np.float32)
+      words.append(values[0])
+  
+  def write_matrix(tmp_path):
+    with open(tmp_path, "wb") as f:
+      np.save(f, matrix[:len(words)])
+  
+  def write_vocabulary(tmp_path):
+    with open(tmp_path, "w", encoding="utf-8") as f:
+      for word in words:
+        f.write(word + "\n")
+  
+  # the matrix first: the store is considered complete when the vocabulary exists.
+  # Both are written atomically, so that other processes never read a partial file
+  COM.write_file_atomically(get_matrix_path(dimension), write_matrix)
+  COM.write_file_atomically(get_vocabulary_path(dimension), write_vocabulary)
+
+
+"""
+Returns a tuple (list of words, memory-mapped float32 matrix)
+with the first number_words words of the store
+"""
+def load_glove_store(dimension, number_words):
+  if not exists_glove_store(dimension):
+    print("GloVe binary store not found. \nComputing file...")
+    save_glove_store(dimension)
+  
+  words = []
+  with open(get_vocabulary_path(dimension), encoding="utf-8") as f:
+    for line in f:
+      if len(words) == number_words:
+        break
+      words.append(line.rstrip("\n"))
+  
+  matrix = np.load(get_matrix_path(dimension), mmap_mode="r")
+  
+  return words, matrix[:len(words)]
@@ -0,0 +1,81 @@
+import numpy as np
+
+
+"""
+  Index for the coarse-to-fine search down the symptom tree.
+  
+  Each node has the centroid of its subtree: the normalized sum of the normalized vectors
+  of the concept names in the subtree (nodes whose concept name is not in the ConceptStore
+  don't contribute). A search starts from some root nodes and goes down level by level,
+  keeping only the beam_width children whose centroids are the most similar to the
+  subsentences. The concept names of the nodes it reaches are the candidates for the full scoring.
+  
+  Nodes are numbered in pre-order, as in the CompactTree of the symptom tree:
+    - rows: row of the concept store of each node, -1 if not in the store
+    - centroids: #nodes x d matrix of the centroids, zero rows for subtrees without vectors
+    - the children of the node in position p are child_positions[child_offsets[p]:child_offsets[p+1]]
+"""
+
+
+class HierarchicalIndex:
+  
+  
+  def __init__(self, tree, concept_store):
+    store_rows = {(cui, concept_name): row
+                  for row, (cui, concept_name) in enumerate(zip(concept_store.cuis,
+                                                                 concept_store.concept_names))}
+    self.rows = np.array([store_rows.get((tree.get_cui(position), concept_name), -1)
+                          for position, concept_name in enumerate(tree.normalized_concept_names)],
+                         dtype=np.int64)
+    
+    parents = tree.parents
+    depths = tree.depths
+    
+    # sums of the subtrees, accumulated from the deepest level up to the root
+    sums = np.zeros((len(tree), concept_store.d), dtype=np.float32)
+    in_store = self.rows >= 0
+    sums[in_store] = concept_store.vectors[self.rows[in_store]]
+    for depth in range(depths.max(), 0, -1):
+      level = np.flatnonzero(depths == depth)
+      np.add.at(sums, parents[level], sums[level])
+    
+    norms = np.linalg.norm(sums, axis=1)
+    self.non_empty = norms > 0
+    norms[~self.non_empty] = 1
+    self.centroids = sums / norms[:, np.newaxis]
+    
+    # positions are increasing, so the children of each node stay in pre-order
+    self.child_positions = np.argsort(parents[1:], kind="stable") + 1
+    self.child_offsets = np.concatenate([[0], np.cumsum(np.bincount(parents[1:], minlength=len(tree)))])
+  
+  
+  """
+  Returns the sorted rows of the concept store of the nodes reached going down
+  from root_nodes with a beam of beam_width nodes per level,
+  guided by the subsentences on the rows of A.
+  The root nodes and the inner nodes along the way are candidates too.
+  """
+  def get_candidates(self, A, root_nodes, beam_width):
+    A = np.asarray(A, dtype=np.float32)
+    norms_A = np.linalg.norm(A, axis=1)
+    norms_A[norms_A == 0] = 1
+    A = A / norms_A[:, np.newaxis]
+    
+    frontier = np.array([node.position for node in root_nodes], dtype=np.int64)
+    reached = [frontier]
+    
+    while len(frontier) > 0:
+      children = np.concatenate([self.child_positions[self.child_offsets[p]:self.child_offsets[p + 1]]
+                                 for p in frontier])
+      children = children[self.non_empty[children]]
+      
+      if len(children) > beam_width:
+        # a child is as good as its most similar subsentence
+        similarities = (A @ self.centroids[children].T).max(axis=0)
+        children = children[np.argpartition(-similarities, beam_width - 1)[:beam_width]]
+      
+      reached.append(children)
+      frontier = children
+    
+    rows = self.rows[np.concatenate(reached)]
+    return np.unique(rows[rows >= 0])
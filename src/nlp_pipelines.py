@@ -0,0 +1,33 @@
+import stanfordnlp
+import commons as COM
+import os
+
+
+"""
+  Registry of the stanfordnlp pipelines of the process.
+  
+  A pipeline is identified by its processors and options: it is loaded the first time
+  it is requested and then shared by all the SentencePOSTaggers,
+  so the models of each processor set are in memory once per process.
+"""
+
+# processors => stanfordnlp.Pipeline
+loaded_pipelines = {}
+
+
+"""
+Returns the pipeline with those processors (None => the default ones of stanfordnlp),
+loading it if it is the first time it is requested
+"""
+def get_pipeline(processors=None):
+  if processors not in loaded_pipelines:
+    if not os.path.isdir(COM.STANFORD_NLP_RESOURCES_PATH):
+      stanfordnlp.download('en', force = True, resource_dir = COM.STANFORD_NLP_RESOURCES_PATH)
+    
+    options = {"models_dir": COM.STANFORD_NLP_RESOURCES_PATH}
+    if processors is not None:
+      options["processors"] = processors
+    
+    loaded_pipelines[processors] = stanfordnlp.Pipeline(**options)
+  
+  return loaded_pipelines[processors]
@@ -3,11 +3,11 @@ import json
 from preprocessed_sentence import PreprocessedSentence
 from qa_system import QASystem
 from answers_interpreter import AnswersInterpreter
-from sentence_pos_tagger import SentencePOSTagger
+from sentence_pos_tagger import get_default_sentence_pos_tagger
 from vectorifier import Vectorifier
 from symptom_tree import SymptomTree
 from dataset_loader import DatasetLoader
-from tokenizer import Tokenizer
+from embedding_cache import EmbeddingCache
 
 
 class Predictor:
@@ -31,6 +31,28 @@ class Predictor:
     default: 100000
   dimension_glove_vectors
     default: 100
+  subsentence_strategy
+    how the subsentences of a token are generated, see COM.SUBSENTENCE_STRATEGIES
+  max_subset_size
+    maximum number of words of a subsentence with the "max_size" strategy
+  max_subsentences
+    hard ceiling on the number of subsentences generated for a token, None => no ceiling
+  use_embedding_cache
+    if true, bert vectors of texts are cached on disk (COM.SQLITE_EMBEDDING_CACHE) between runs
+  quantization
+    if "float16" or "int8", the concept name vectors are kept quantized in memory
+    (the best candidates are re-scored at full precision)
+  use_ann
+    if true, the searches in the whole symptom tree are approximated with an IVF index
+  ann_probes
+    number of lists of the IVF index searched for each token (more => higher recall, slower)
+  use_hierarchical_search
+    if true, the searches go down the symptom tree keeping beam_width subtrees per level
+  beam_width
+    number of subtrees kept at each level of the hierarchical search
+  persist_memo
+    if true, the best matches of the tokens are saved after predict_testing
+    and reused by the next runs with the same settings
   """
   def __init__(self,
                qa_system_type,
@@ -40,7 +62,17 @@ class Predictor:
                pruning=True,
                filter_unuseful_words_from_tokens=True,
                number_glove_words=COM.DEFAULT_NUM_IMPORTED_GLOVE_VECTORS,
-               dimension_glove_vectors=COM.POSSIBLE_GLOVE_DIMENSIONS[COM.DEFAULT_GLOVE_DIMENSION]):
+               dimension_glove_vectors=COM.POSSIBLE_GLOVE_DIMENSIONS[COM.DEFAULT_GLOVE_DIMENSION],
+               subsentence_strategy=COM.SUBSENTENCE_STRATEGIES[COM.DEFAULT_SUBSENTENCE_STRATEGY],
+               max_subset_size=COM.DEFAULT_MAX_SUBSET_SIZE,
+               max_subsentences=COM.MAX_SUBSENTENCES_PER_TOKEN,
+               use_embedding_cache=False,
+               quantization=None,
+               use_ann=False,
+               ann_probes=COM.DEFAULT_IVF_PROBES,
+               use_hierarchical_search=False,
+               beam_width=COM.DEFAULT_BEAM_WIDTH,
+               persist_memo=False):
     # initialize QA system
     if qa_system_type in COM.QA_SYSTEM_TYPES:
       self.__qas = QASystem(qa_system_type)
@@ -54,22 +86,43 @@ class Predictor:
     self.__filter_unuseful_words = filter_unuseful_words_from_tokens
     
     # initialize SentencePOSTagger
-    self.__spt = SentencePOSTagger()
-    
-    #initialize Tokenizer
-    self.__tokenizer = Tokenizer()
+    self.__spt = get_default_sentence_pos_tagger()
     
     # initialize answer interpreter
     self.__ai = AnswersInterpreter(spt=self.__spt)
     
+    # initialize embedding cache
+    self.__embedding_cache = EmbeddingCache() if use_embedding_cache else None
+    
     # initialize vectorifier
     self.__vect = Vectorifier(internal_representation_type,
                               number_glove_words,
                               dimension_glove_vectors,
-                              self.__spt)
+                              self.__spt,
+                              subsentence_strategy,
+                              max_subset_size,
+                              max_subsentences,
+                              embedding_cache=self.__embedding_cache)
     
     # initialize symptom tree
-    self.__st = SymptomTree(self.__vect)
+    self.__st = SymptomTree(self.__vect,
+                            quantization=quantization,
+                            use_ann=use_ann,
+                            ann_probes=ann_probes,
+                            use_hierarchical_search=use_hierarchical_search,
+                            beam_width=beam_width,
+                            persist_memo=persist_memo)
+    self.__persist_memo = persist_memo
+    
+    # appended to the name of the results file
+    self.__search_settings_suffix = COM.get_search_settings_suffix(subsentence_strategy,
+                                                                   max_subset_size,
+                                                                   max_subsentences,
+                                                                   quantization,
+                                                                   use_ann,
+                                                                   ann_probes,
+                                                                   use_hierarchical_search,
+                                                                   beam_width)
     
     # initialize dataset loader
     self.__dl = DatasetLoader()
@@ -93,10 +146,29 @@ class Predictor:
     results = []
     i = 1
     
-    for text_sentence, sentence_cuis in sentences_and_cuis:
-      print("Predicting n" + str(i) + ": \"" + text_sentence + "\"\n")
-      cui_predictions, tokens_for_pred = self.predict(text_sentence)
+    # the sentences are processed in batches, annotated together by the SentencePOSTagger
+    list_tokens_and_body_parts = []
+    for start in range(0, len(sentences_and_cuis), COM.ANNOTATION_BATCH_SIZE):
+      texts_sentences = [text_sentence for text_sentence, _ in
+                         sentences_and_cuis[start:(start + COM.ANNOTATION_BATCH_SIZE)]]
+      list_tokens_and_body_parts.extend(self.__get_list_tokens_and_body_parts(texts_sentences))
       
+      # printed when the batch is done, the tokens of its sentences are computed together
+      for text_sentence in texts_sentences:
+        print("Preprocessed n" + str(i) + ": \"" + text_sentence + "\"\n")
+        i += 1
+    
+    # the tokens of all the sentences are searched together in the symptom tree
+    list_predictions = self.__get_predictions_given_tokens_and_body_parts(list_tokens_and_body_parts)
+    
+    memo_statistics = self.__st.get_memo_statistics()
+    print("Tokens memo: " + str(memo_statistics["hits"]) + " hits, " + \
+          str(memo_statistics["misses"]) + " misses")
+    if self.__persist_memo:
+      self.__st.save_memo()
+    
+    for (text_sentence, sentence_cuis), (cui_predictions, tokens_for_pred) in zip(sentences_and_cuis,
+                                                                                  list_predictions):
       d1 = dict()
       d1["text_sentence"] = text_sentence
       d1["tokens_for_pred"] = tokens_for_pred
@@ -112,8 +184,6 @@ class Predictor:
       d2["cui_predictions"] = cui_predictions
       d2["real_cuis"] = sentence_cuis
       results.append(d2)
-      
-      i += 1
     
     if self.__qas.model_type == "rnet":
       # write file of sentences and tokens for QASystem evaluation
@@ -135,6 +205,7 @@ class Predictor:
                ("pruning" if self.__pruning else "no_pruning") + "-" + \
                "min_sim" + str(self.__min_similarity) + "-" + \
                ("filter_words" if self.__filter_unuseful_words else "no_filter_words") + \
+               self.__search_settings_suffix + \
                ".json"
     
     #write file of results
@@ -148,59 +219,76 @@ class Predictor:
   text_tokens: list of tokens used for prediction (used for evaluation purposes of QASystem)
   """
   def predict(self, patient_sentence_text):
+    tokens_and_body_parts = self.__get_list_tokens_and_body_parts([patient_sentence_text])[0]
     
-    # preprocess sentence (tag eventual body parts)
-    preprocessed_sentence = PreprocessedSentence(patient_sentence_text, self.__tokenizer)
+    return self.__get_predictions_given_tokens_and_body_parts([tokens_and_body_parts])[0]
+  
+  
+  """
+  Returns for each sentence the list of the tokens to search in the symptom tree,
+  as tuples (token, body part where to search it or None)
+  
+  The sentences, and then their answers, are annotated in one call of the pipeline
+  """
+  def __get_list_tokens_and_body_parts(self, patient_sentences_text):
+    self.__spt.annotate_texts(patient_sentences_text)
     
-    # get answers given preprocessed sentence
-    answers = self.__qas.get_answers_given_sentence(preprocessed_sentence)
+    list_answers = []
+    for patient_sentence_text in patient_sentences_text:
+      # preprocess sentence (tag eventual body parts)
+      preprocessed_sentence = PreprocessedSentence(patient_sentence_text, self.__spt)
+      
+      # get answers given preprocessed sentence
+      list_answers.append(self.__qas.get_answers_given_sentence(preprocessed_sentence))
     
     # get searching tokens of symptoms and of body parts
-    tokens_symptoms, tokens_body_parts = self.__ai.get_tokens_given_answers(answers, self.__filter_unuseful_words)
-    
-    # get predictions CUI
-    predictions = []
-    text_tokens = []
-    for token_symptom in tokens_symptoms:
-      # returns a tuple (cui, similarity)
-      d = self.__st.get_most_similar_cui_given_symptom_token(token_symptom,
-                                                             min_similarity=self.__min_similarity)
+    list_tokens = self.__ai.get_tokens_given_list_answers(list_answers, self.__filter_unuseful_words)
+    
+    ret = []
+    for tokens_symptoms, tokens_body_parts in list_tokens:
+      tokens_and_body_parts = [(token_symptom, None) for token_symptom in tokens_symptoms]
       
-      if d["found"] == "yes":
-          predicted_cui = d["predicted_cui"]
-      else:
-          predicted_cui = None
+      # if is enabled the optimization for searching the body parts
+      if self.__search_for_body_parts:
+        for body_part, tokens_body_part in tokens_body_parts:
+          for token_body_part in tokens_body_part:
+            # if pruning, search only in the subtrees related to that body part
+            # for evaluation purposes
+            tokens_and_body_parts.append((token_body_part, body_part if self.__pruning else None))
+      
+      ret.append(tokens_and_body_parts)
+    
+    return ret
+  
+  
+  """
+  Given a list with the tokens and body parts of each sentence,
+  search all of them in the symptom tree in one batch and
+  return for each sentence the tuple (predictions, text_tokens) as predict does
+  """
+  def __get_predictions_given_tokens_and_body_parts(self, list_tokens_and_body_parts):
+    all_tokens_and_body_parts = [t for tokens_and_body_parts in list_tokens_and_body_parts
+                                 for t in tokens_and_body_parts]
+    
+    list_d = self.__st.get_most_similar_cuis_given_tokens([token for token, _ in all_tokens_and_body_parts],
+                                                          [body_part for _, body_part in all_tokens_and_body_parts],
+                                                          min_similarity=self.__min_similarity)
+    
+    ret = []
+    start = 0
+    for tokens_and_body_parts in list_tokens_and_body_parts:
+      predictions = []
+      text_tokens = []
       
-      text_tokens.append(token_symptom)
+      for (token, _), d in zip(tokens_and_body_parts, list_d[start:(start + len(tokens_and_body_parts))]):
+        text_tokens.append(token)
+        
+        if d["found"] == "yes":
+          predictions.append(d["predicted_cui"])
       
-      if predicted_cui != None:
-        predictions.append(predicted_cui)
-    
-    # if is enabled the optimization for searching the body parts
-    if self.__search_for_body_parts:
-      for body_part, tokens_body_part in tokens_body_parts:
-        for token_body_part in tokens_body_part:
-          
-          # if pruning, search only in the subtrees related to that body part
-          # for evaluation purposes
-          if self.__pruning:
-            d = self.__st.get_most_similar_cui_given_body_part_token(token_body_part,
-                                                                     body_part,
-                                                                     min_similarity=self.__min_similarity)
-          else:
-            d = self.__st.get_most_similar_cui_given_symptom_token(token_body_part,
-                                                                   min_similarity=self.__min_similarity)
-            
-          if d["found"] == "yes":
-            predicted_cui = d["predicted_cui"]
-          else:
-            predicted_cui = None
-          
-          text_tokens.append(token_body_part)
-          
-          if predicted_cui != None:
-            predictions.append(predicted_cui)
-    
-    return predictions, text_tokens
+      ret.append((predictions, text_tokens))
+      start += len(tokens_and_body_parts)
+    
+    return ret
   
     
\ No newline at end of file
@@ -6,8 +6,8 @@ from body_part import BodyPart
 class PreprocessedSentence:
   
   
-  def __init__(self, sentence_text, tokenizer):
-    bpt = BodyPartTagger(tokenizer)
+  def __init__(self, sentence_text, spt):
+    bpt = BodyPartTagger(spt)
     self.text = sentence_text
     self.__body_parts = bpt.get_body_parts_in_sentence(sentence_text)
     
@@ -24,8 +24,8 @@ class PreprocessedSentence:
 class BodyPartTagger:
   
   
-  def __init__(self, tokenizer):
-    self.__tokenizer = tokenizer
+  def __init__(self, spt):
+    self.__spt = spt
     
     #carica file e lista di body parts
     self.body_parts = []
@@ -40,8 +40,12 @@ class BodyPartTagger:
       self.body_parts.append(bp)
   
   
+  """
+  The words of the sentence are taken from its AnnotatedDocument,
+  so the sentence is parsed once for tagging and for the other uses of the SentencePOSTagger
+  """
   def get_body_parts_in_sentence(self, sentence):
-    tokens = self.__tokenizer.tokenize(sentence)
+    tokens = self.__spt.annotate(sentence).words
     
     found_body_parts = []
     for body_part in self.body_parts:
@@ -0,0 +1,110 @@
+import commons as COM
+import numpy as np
+
+
+class QuantizedMatrix:
+  
+  
+  """
+  Compact copy of a float matrix, to save memory when many processes hold it.
+  
+  mode: "float16" => values stored as float16
+        "int8"    => each row is scaled in [-127, 127] and stored as int8,
+                     with one float32 scale per row
+  
+  Indexing (matrix[rows]) returns the dequantized float32 rows.
+  """
+  def __init__(self, matrix, mode):
+    if mode not in COM.QUANTIZATION_MODES:
+      raise Exception("Supported quantization modes: " + ", ".join(COM.QUANTIZATION_MODES))
+    
+    self.mode = mode
+    self.shape = matrix.shape
+    
+    if mode == "float16":
+      self.__data = np.zeros(self.shape, dtype=np.float16)
+      self.__scales = None
+    elif mode == "int8":
+      self.__data = np.zeros(self.shape, dtype=np.int8)
+      self.__scales = np.ones(self.shape[0], dtype=np.float32)
+    
+    # quantize by blocks, so a memory-mapped matrix is never loaded in memory at once
+    for start in range(0, self.shape[0], COM.QUANTIZATION_BLOCK_SIZE):
+      end = min(start + COM.QUANTIZATION_BLOCK_SIZE, self.shape[0])
+      block = np.asarray(matrix[start:end], dtype=np.float32)
+      
+      if mode == "float16":
+        self.__data[start:end] = block
+      elif mode == "int8":
+        scales = np.abs(block).max(axis=1) / 127
+        scales[scales == 0] = 1
+        self.__scales[start:end] = scales
+        self.__data[start:end] = np.round(block / scales[:, np.newaxis])
+  
+  
+  def __len__(self):
+    return self.shape[0]
+  
+  
+  def __getitem__(self, rows):
+    block = self.__data[rows].astype(np.float32)
+    
+    if self.mode == "int8":
+      block *= self.__scales[rows][..., np.newaxis]
+    
+    return block
+  
+  
+  """
+  Returns A M^T (approximated), where M is this matrix restricted to rows if passed
+  
+  A is #examplesA x #features
+  """
+  def dot(self, A, rows=None):
+    if rows is None:
+      rows = np.arange(self.shape[0])
+    
+    A = np.asarray(A, dtype=np.float32)
+    ret = np.zeros((A.shape[0], len(rows)), dtype=np.float32)
+    
+    for start in range(0, len(rows), COM.QUANTIZATION_BLOCK_SIZE):
+      end = min(start + COM.QUANTIZATION_BLOCK_SIZE, len(rows))
+      ret[:, start:end] = A @ self[rows[start:end]].T
+    
+    return ret
+
+
+"""
+Similarity matrix between A and the concept names of rows of the ConceptStore concept_store,
+computed on quantized_matrix (the quantized vectors of the store) and re-scored
+at full precision only for the best n_candidates concept names of each row of A.
+
+The similarity of the concepts that are not candidates of the row is -inf,
+so the argmax of each row is the same of the exact similarity matrix
+as long as the best concept is among the candidates, and it does not depend
+on the other rows of A.
+"""
+def get_reranked_similarity_matrix(A, quantized_matrix, concept_store, rows, n_candidates):
+  if rows is None:
+    rows = np.arange(len(concept_store))
+  
+  # all the concept names are candidates (e.g. small body parts): only the exact similarity is needed
+  if n_candidates >= len(rows):
+    return concept_store.similarity(A, rows)
+  
+  approximated_similarity = concept_store.get_similarity_given_dot_products(quantized_matrix.dot(A, rows),
+                                                                            A,
+                                                                            rows)
+  
+  row_candidates = np.argpartition(-approximated_similarity, n_candidates - 1, axis=1)[:, :n_candidates]
+  
+  # the candidates of all the rows are re-scored together, each row keeps only its own ones
+  candidates = np.unique(row_candidates)
+  exact_similarity = concept_store.similarity(A, rows[candidates])
+  row_indexes = np.arange(len(row_candidates))[:, np.newaxis]
+  positions = np.searchsorted(candidates, row_candidates)
+  
+  similarity_matrix = np.full(approximated_similarity.shape, -np.inf)
+  similarity_matrix[row_indexes, row_candidates] = exact_similarity[row_indexes, positions]
+  
+  return similarity_matrix
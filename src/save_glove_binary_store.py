@@ -0,0 +1,7 @@
+import commons as COM
+import glove_store
+
+
+for dimension in COM.POSSIBLE_GLOVE_DIMENSIONS:
+  print("Converting GloVe vectors of dimension " + str(dimension))
+  glove_store.save_glove_store(dimension)
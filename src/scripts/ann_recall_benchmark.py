@@ -0,0 +1,80 @@
+import time
+import numpy as np
+import commons as COM
+import ann_index
+import concept_store
+from dataset_loader import DatasetLoader
+from preprocessed_sentence import PreprocessedSentence
+from qa_system import QASystem
+from answers_interpreter import AnswersInterpreter
+from sentence_pos_tagger import get_default_sentence_pos_tagger
+from vectorifier import Vectorifier
+from symptom_tree import SymptomTree
+
+# Recall@1 and speed of the IVF index against the exact search,
+# querying the subsentences of the tokens that the Predictor searches
+# for the sentences in dataset/testing
+# ----------------------------------------------------------------------------
+qa_system_type = "bert"
+internal_representation = "glove"
+dimension_glove_vectors = 100
+subsentence_strategy = COM.SUBSENTENCE_STRATEGIES[COM.DEFAULT_SUBSENTENCE_STRATEGY]
+filter_unuseful_words = True
+n_lists = None # None => sqrt of the number of concept names
+list_n_probes = [1, 2, 4, 8, 16, 32]
+# ----------------------------------------------------------------------------
+
+spt = get_default_sentence_pos_tagger()
+vectorifier = Vectorifier(internal_representation,
+                          dimension_glove_vectors=dimension_glove_vectors,
+                          spt=spt,
+                          subsentence_strategy=subsentence_strategy)
+store = SymptomTree(vectorifier).concept_store
+
+if n_lists is None:
+  n_lists = ann_index.get_default_number_lists(len(store))
+store_path = concept_store.get_concept_store_path(internal_representation, vectorifier.d)
+index_path = ann_index.get_ivf_index_path(store_path, n_lists)
+if not ann_index.exists_ivf_index(index_path):
+  ann_index.build_ivf_index(index_path, store.vectors, n_lists)
+index = ann_index.load_ivf_index(index_path)
+
+# the tokens of the answers of the QA system, as in Predictor.predict_testing
+# (the tokens of the body parts too, the IVF index is used for the searches in the whole tree)
+qas = QASystem(qa_system_type)
+ai = AnswersInterpreter(spt=spt)
+sentences = [text for text, _ in DatasetLoader().get_testing_sentences_and_cuis()]
+spt.annotate_texts(sentences)
+list_answers = [qas.get_answers_given_sentence(PreprocessedSentence(sentence, spt)) for sentence in sentences]
+tokens = []
+for tokens_symptoms, tokens_body_parts in ai.get_tokens_given_list_answers(list_answers, filter_unuseful_words):
+  tokens.extend(tokens_symptoms)
+  for _, tokens_body_part in tokens_body_parts:
+    tokens.extend(tokens_body_part)
+
+# one matrix of subsentences per token, the candidates of the IVF index are computed for each token
+matrices = [matrix for subsentences, matrix in vectorifier.get_subsentences_and_matrices(tokens)
+            if subsentences != []]
+n_queries = sum(len(matrix) for matrix in matrices)
+print(str(len(store)) + " concept names, " + str(n_lists) + " lists, " + \
+      str(n_queries) + " subsentences of " + str(len(matrices)) + " tokens")
+
+start = time.time()
+exact_best = [store.similarity(matrix).max(axis=1) for matrix in matrices]
+elapsed = time.time() - start
+print("exact: " + str(round(n_queries / elapsed)) + " subsentences/s")
+
+for n_probes in list_n_probes:
+  hits = 0
+  n_candidates = 0
+  start = time.time()
+  for matrix, best in zip(matrices, exact_best):
+    rows = index.get_candidates(matrix, n_probes)
+    approximated_best = store.similarity(matrix, rows).max(axis=1)
+    # a hit if the approximated best concept name is as similar as the exact one (ties included)
+    hits += int(np.sum(approximated_best >= best - 1e-6))
+    n_candidates += len(rows)
+  elapsed = time.time() - start
+  print("ivf n_probes=" + str(n_probes) + ": recall@1 " + str(round(hits / n_queries, 4)) + ", " + \
+        str(round(n_queries / elapsed)) + " subsentences/s, " + \
+        str(round(n_candidates / len(matrices))) + " concept names scored per token")
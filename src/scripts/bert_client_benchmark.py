@@ -0,0 +1,36 @@
+import time
+from bert_serving.client import BertClient
+from bert_client_pool import BertClientPool
+from bert_stand_in_server import BertStandInServer
+
+# Throughput of a single BertClient vs BertClientPool against the local stand-in server
+# ----------------------------------------------------------------------------
+n_sentences = 20000
+batch_size = 64
+latency = 0.05 # seconds per request
+n_clients = 4
+max_pending_batches = 8
+# ----------------------------------------------------------------------------
+
+sentences = ["sentence number " + str(i) for i in range(n_sentences)]
+
+with BertStandInServer(latency=latency) as server:
+  bc = BertClient(ip="localhost", port=server.port, port_out=server.port_out)
+  start = time.time()
+  for i in range(0, n_sentences, batch_size):
+    bc.encode(sentences[i:(i + batch_size)])
+  elapsed = time.time() - start
+  bc.close()
+  print("BertClient: " + str(round(n_sentences / elapsed)) + " sentences/s")
+  
+  pool = BertClientPool(ip="localhost",
+                        port=server.port,
+                        port_out=server.port_out,
+                        n_clients=n_clients,
+                        max_pending_batches=max_pending_batches,
+                        batch_size=batch_size)
+  start = time.time()
+  pool.encode(sentences)
+  elapsed = time.time() - start
+  pool.close()
+  print("BertClientPool (" + str(n_clients) + " clients): " + str(round(n_sentences / elapsed)) + " sentences/s")
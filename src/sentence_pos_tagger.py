@@ -1,29 +1,111 @@
-import stanfordnlp
 from nltk.stem.snowball import SnowballStemmer
 import pandas as pd
 import commons as COM
+import nlp_pipelines
+from annotated_document import AnnotatedDocument
+import bisect
+import hashlib
 import os
+import pickle
+from collections import OrderedDict
 
 class SentencePOSTagger:
   
   
   def __init__(self):
-    if not os.path.isdir(COM.STANFORD_NLP_RESOURCES_PATH):
-      stanfordnlp.download('en', force = True, resource_dir = COM.STANFORD_NLP_RESOURCES_PATH)
-    
-    self.nlp = stanfordnlp.Pipeline(models_dir = COM.STANFORD_NLP_RESOURCES_PATH)
-    
     glove_100000_word_list_df = pd.read_csv(COM.CSV_WORD_LIST_GLOVE_100000, header=None)
     self.__stemmer = SnowballStemmer("english")
-    self.__list_glove_words = glove_100000_word_list_df[0].tolist()
+    self.__glove_words = frozenset(glove_100000_word_list_df[0].tolist())
+    
+    # stems of the GloVe words, precomputed, and of the other words, computed when met
+    self.__stem_table = self.__load_stem_table()
+    self.__stem_memo = OrderedDict()
+    
+    # AnnotatedDocuments of the last texts parsed, text => document
+    self.__documents = OrderedDict()
+  
+  
+  # the full pipeline is shared by the process (see nlp_pipelines), loaded at the first parse
+  @property
+  def nlp(self):
+    return nlp_pipelines.get_pipeline()
   
   
   """
-  Given one sentence in text, returns a Sentence object
+  Given one sentence in text, returns its AnnotatedDocument.
+  The text is parsed only if it is not among the last COM.DEFAULT_ANNOTATION_CACHE_ENTRIES
+  texts annotated.
   """
-  def parse_sentence(self, sentence_text):
+  def annotate(self, sentence_text):
+    if sentence_text in self.__documents:
+      self.__documents.move_to_end(sentence_text)
+      return self.__documents[sentence_text]
+    
     doc = self.nlp(sentence_text)
-    return doc.sentences[0]
+    document = AnnotatedDocument(sentence_text, doc.sentences[0].words)
+    self.__add_document(document)
+    
+    return document
+  
+  
+  """
+  Given a list of texts, returns the list of their AnnotatedDocuments, as annotate does
+  for each of them. The texts not annotated yet are parsed in one call of the pipeline.
+  
+  The texts are passed to the pipeline separated by blank lines, so that no sentence
+  spans two texts, and each sentence is given back to its text counting the
+  non-space characters of its tokens. If the count does not match (the pipeline
+  changed the text), the texts are annotated one at a time.
+  """
+  def annotate_texts(self, sentences_text):
+    # text => document, also for the texts that fall out of the cache before the end
+    documents = {}
+    for sentence_text in sentences_text:
+      if sentence_text in self.__documents:
+        self.__documents.move_to_end(sentence_text)
+        documents[sentence_text] = self.__documents[sentence_text]
+      elif sentence_text.strip() == "":
+        # texts without characters have no sentences
+        documents[sentence_text] = AnnotatedDocument(sentence_text, [])
+    
+    texts_to_parse = list(dict.fromkeys(sentence_text for sentence_text in sentences_text
+                                        if sentence_text not in documents))
+    
+    if texts_to_parse != []:
+      doc = self.nlp("\n\n".join(texts_to_parse))
+      
+      # the non-space characters of the texts end at these offsets
+      ends = []
+      for sentence_text in texts_to_parse:
+        ends.append((ends[-1] if ends else 0) + count_characters(sentence_text))
+      
+      words_of_texts = [None for _ in texts_to_parse]
+      aligned = True
+      start = 0
+      for sentence in doc.sentences:
+        i = bisect.bisect_right(ends, start)
+        start += sum(count_characters(token.text) for token in sentence.tokens)
+        if i == len(ends) or start > ends[i]:
+          aligned = False
+          break
+        # only the first sentence of each text, as in annotate
+        if words_of_texts[i] is None:
+          words_of_texts[i] = sentence.words
+      
+      if aligned and start == ends[-1]:
+        for sentence_text, words in zip(texts_to_parse, words_of_texts):
+          documents[sentence_text] = AnnotatedDocument(sentence_text, words if words is not None else [])
+          self.__add_document(documents[sentence_text])
+    
+    return [documents[sentence_text] if sentence_text in documents else self.annotate(sentence_text)
+            for sentence_text in sentences_text]
+  
+  
+  def __add_document(self, document):
+    self.__documents[document.text] = document
+    self.__documents.move_to_end(document.text)
+    if len(self.__documents) > COM.DEFAULT_ANNOTATION_CACHE_ENTRIES:
+      self.__documents.popitem(last=False)
   
   
   """
@@ -39,23 +121,46 @@ class SentencePOSTagger:
   def filter_unuseful_words(self, 
                             sentence_text,
                             admitted_types = ["NOUN", "ADJ", "CCONJ", "PUNCT", "VERB", "AUX"]):
-    ambiguous_words = ["back"]
-    
     if sentence_text == "":
       return ""
     
-    sentence = self.parse_sentence(sentence_text)
+    words = self.annotate(sentence_text).words
     
     res = ""
-    for word in sentence.words:
-      if word.upos in admitted_types or word.text in ambiguous_words:
-        res += word.text
-        if word != sentence.words[-1]:
-          res += " "
+    for word in self.__get_useful_words(words, admitted_types):
+      res += word.text
+      if word != words[-1]:
+        res += " "
     
     return res
   
   
+  """
+  Returns the same of stem_sentence(filter_unuseful_words(sentence_text, admitted_types)),
+  parsing the sentence only once: the words kept by the filter are stemmed directly.
+  The result is memoized on the AnnotatedDocument of the sentence.
+  """
+  def filter_unuseful_words_and_stem(self,
+                                     sentence_text,
+                                     admitted_types = ["NOUN", "ADJ", "CCONJ", "PUNCT", "VERB", "AUX"]):
+    if sentence_text == "":
+      return ""
+    
+    document = self.annotate(sentence_text)
+    key = tuple(admitted_types)
+    if key not in document.filtered_stemmed_texts:
+      document.filtered_stemmed_texts[key] = self.__stem_words(self.__get_useful_words(document.words,
+                                                                                         admitted_types))
+    
+    return document.filtered_stemmed_texts[key]
+  
+  
+  def __get_useful_words(self, words, admitted_types):
+    ambiguous_words = ["back"]
+    
+    return [word for word in words if word.upos in admitted_types or word.text in ambiguous_words]
+  
+  
   """
   Given a string containing a sentence,
   returns a string (the stemmed sentence)
@@ -64,20 +169,112 @@ class SentencePOSTagger:
     if sentence_text == "":
       return sentence_text
     
-    sentence = self.parse_sentence(sentence_text)
+    document = self.annotate(sentence_text)
+    if document.stemmed_text is None:
+      document.stemmed_text = self.__stem_words(document.words)
     
+    return document.stemmed_text
+  
+  
+  """
+  Given a list of strings, returns the list of the stemmed strings,
+  as stem_sentence does for each of them.
+  
+  The words of the strings must be separated by spaces (e.g. stripped concept names),
+  so they are split on the spaces and stemmed without the pipeline.
+  """
+  def stem_sentences(self, sentences_text):
+    return [" ".join(self.stem_word(word_text) for word_text in sentence_text.split())
+            for sentence_text in sentences_text]
+  
+  
+  def __stem_words(self, words):
     res = ""
-    for word in sentence.words:
-      stemmed_word = self.__stemmer.stem(word.text)
+    for word in words:
+      res += self.stem_word(word.text)
       
-      if stemmed_word in self.__list_glove_words:
-        res += stemmed_word
-      else:
-        res += word.text
-      
-      if word != sentence.words[-1]:
+      if word != words[-1]:
         res += " "
     
     return res
+
+
+  """
+  Returns the stem of the word if it is a GloVe word, the word itself otherwise
+  """
+  def stem_word(self, word_text):
+    stemmed_word = self.__stem_table.get(word_text)
+    if stemmed_word is not None:
+      return stemmed_word
+    
+    if word_text in self.__stem_memo:
+      self.__stem_memo.move_to_end(word_text)
+      return self.__stem_memo[word_text]
+    
+    stemmed_word = self.__stemmer.stem(word_text)
+    if stemmed_word not in self.__glove_words:
+      stemmed_word = word_text
+    
+    self.__stem_memo[word_text] = stemmed_word
+    if len(self.__stem_memo) > COM.DEFAULT_STEM_MEMO_ENTRIES:
+      self.__stem_memo.popitem(last=False)
+    
+    return stemmed_word
+  
+  
+  """
+  The table word => result of stem_word of all the GloVe words is saved in
+  COM.PICKLE_STEM_TABLE_PATH together with the hash of COM.CSV_WORD_LIST_GLOVE_100000,
+  so it is computed again only when the word list changes
+  """
+  def __load_stem_table(self):
+    with open(COM.CSV_WORD_LIST_GLOVE_100000, "rb") as f:
+      word_list_hash = hashlib.sha256(f.read()).hexdigest()
+    
+    try:
+      with open(COM.PICKLE_STEM_TABLE_PATH, "rb") as f:
+        cache = pickle.load(f)
+      if cache.get("word_list_hash") == word_list_hash:
+        return cache["stem_table"]
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+      pass
+    
+    stem_table = {}
+    for word in self.__glove_words:
+      # words read as numbers or NaN by pandas
+      if isinstance(word, str):
+        stemmed_word = self.__stemmer.stem(word)
+        stem_table[word] = stemmed_word if stemmed_word in self.__glove_words else word
+    
+    os.makedirs(COM.PICKLE_PATH, exist_ok=True)
+    
+    def write(tmp_path):
+      with open(tmp_path, "wb") as f:
+        pickle.dump({"word_list_hash": word_list_hash, "stem_table": stem_table}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    
+    COM.write_file_atomically(COM.PICKLE_STEM_TABLE_PATH, write)
+    
+    return stem_table
+
+
+"""
+Number of characters of a text, without the spaces
+"""
+def count_characters(text):
+  return len("".join(text.split()))
+
+
+"""
+SentencePOSTagger used by who doesn't pass one (AnswersInterpreter, Vectorifier, ...),
+created at the first request and shared by the process
+"""
+default_spt = None
+
+
+def get_default_sentence_pos_tagger():
+  global default_spt
+  if default_spt is None:
+    default_spt = SentencePOSTagger()
   
-  
\ No newline at end of file
+  return default_spt
@@ -1,40 +1,114 @@
 import commons as COM
-import anytree as at
+import hashlib
+import io
 import os
+import pickle
+import concept_store
+import ann_index
 import pandas as pd
 import numpy as np
-from anytree.importer import DictImporter
-from anytree.importer import JsonImporter
+from quantization import QuantizedMatrix, get_reranked_similarity_matrix
+from hierarchical_index import HierarchicalIndex
+from compact_tree import import_compact_tree
+from collections import OrderedDict
 
-fh = open(COM.JSON_SYMPTOM_TREE_PATH, "r")
-symptom_json = fh.read()
+# symptom tree (CompactTree) and hash of its json, loaded once per process by load_symptom_tree
+loaded_tree = None
+loaded_json_hash = None
 
 
-class Node(at.node.node.Node):
-  # concept_name identifies univoquely the node
-  def get_concept_name(self):
-    return COM.strip_string(self.concept_name)
-  
-  def __eq__(self, other):
-    return self.get_concept_name() == other.get_concept_name()
-  
-  
-  def __hash__(self):
-    return hash(self.__repr__())
-  
+"""
+Returns the CompactTree of the symptom tree in COM.JSON_SYMPTOM_TREE_PATH.
+
+The tree is loaded the first time it is needed and then shared by all the SymptomTree
+instances of the process. The imported tree is saved in a binary cache
+(COM.PICKLE_SYMPTOM_TREE_PATH) together with the hash of the json file, so the json
+is imported again only when it changes.
+"""
+def load_symptom_tree():
+  global loaded_tree, loaded_json_hash
+  
+  if loaded_tree is None:
+    with open(COM.JSON_SYMPTOM_TREE_PATH, "rb") as f:
+      symptom_json = f.read()
+    json_hash = hashlib.sha256(symptom_json).hexdigest()
+    loaded_json_hash = json_hash
+    
+    loaded_tree = load_cached_symptom_tree(json_hash)
+    
+    if loaded_tree is None:
+      loaded_tree = import_compact_tree(symptom_json.decode("utf-8"))
+      save_cached_symptom_tree(loaded_tree, json_hash)
+  
+  return loaded_tree
+
+
+"""
+Returns the tree saved in the binary cache, None if missing or computed from another json
+"""
+def load_cached_symptom_tree(json_hash):
+  try:
+    with open(COM.PICKLE_SYMPTOM_TREE_PATH, "rb") as f:
+      cache = pickle.load(f)
+  except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+    return None
+  
+  # caches of the previous versions hold anytree nodes instead of a CompactTree
+  if cache.get("json_hash") != json_hash or "tree" not in cache:
+    return None
+  
+  return cache["tree"]
+
+
+def save_cached_symptom_tree(tree, json_hash):
+  os.makedirs(COM.PICKLE_PATH, exist_ok=True)
   
+  def write(tmp_path):
+    with open(tmp_path, "wb") as f:
+      pickle.dump({"json_hash": json_hash, "tree": tree}, f, protocol=pickle.HIGHEST_PROTOCOL)
   
+  COM.write_file_atomically(COM.PICKLE_SYMPTOM_TREE_PATH, write)
+
+
+
 class SymptomTree:
   
   """
   Pass to it a Vectorifier object
+  
+  quantization: if passed ("float16" or "int8"), the concept name vectors are kept in memory
+                quantized and the full precision vectors are memory-mapped from disk.
+                Similarities are computed on the quantized vectors, then the best
+                rerank_candidates concept names of each subsentence are re-scored
+                at full precision.
+  use_ann: if True, the searches in the whole tree score only the concept names
+           in the ann_probes lists of an IVF index (see ann_index) closest to the subsentences.
+           The index is built with ann_lists lists (default: sqrt of the number of concept names)
+           the first time it is needed. Searches pruned by body part are always exact.
+  use_hierarchical_search: if True, the searches go down the tree from the root
+                           (or from the root nodes of the body part) keeping at each level
+                           the beam_width subtrees whose centroids are the most similar
+                           to the subsentences (see hierarchical_index); only the concept names
+                           of the nodes reached are scored.
+  memo_size: maximum number of best matches of (token, body part) kept in the LRU memo
+             (0 => no memo)
+  persist_memo: if True, the memo is loaded from disk (if saved by a previous run with
+                the same settings); call save_memo to save it
   """
   def __init__(self,
-               vectorifier=None):
-    
-    dict_importer = DictImporter(nodecls=Node)
-    importer = JsonImporter(dictimporter=dict_importer)
-    self.root = importer.import_(symptom_json)
+               vectorifier=None,
+               quantization=None,
+               rerank_candidates=COM.DEFAULT_RERANK_CANDIDATES,
+               use_ann=False,
+               ann_lists=None,
+               ann_probes=COM.DEFAULT_IVF_PROBES,
+               use_hierarchical_search=False,
+               beam_width=COM.DEFAULT_BEAM_WIDTH,
+               memo_size=COM.DEFAULT_TOKEN_MEMO_ENTRIES,
+               persist_memo=False):
+    
+    self.tree = load_symptom_tree()
+    self.root = self.tree.get_node(0)
     
     if vectorifier is not None:
       # normal mode, if it is None is eval mode
@@ -42,73 +116,123 @@ class SymptomTree:
       self.vector_dimension = vectorifier.d
       
       """
-      if concept name vectors file not exists, create it
+      if concept name vectors store not exists, create it.
+      If it was built from another version of the symptom tree, update it
       """
-      if vectorifier.internal_representation == "glove":
-        if not os.path.isfile(COM.CSV_ST_CONCEPT_NAMES_GLOVE_PATH + \
-                              str(self.vector_dimension) + "d.csv"):
-          print("Concept names glove vectors file not found. \nComputing file...")
-          self.__save_csv_concept_name_glove_vectors()
+      store_path = concept_store.get_concept_store_path(vectorifier.internal_representation,
+                                                        self.vector_dimension)
+      if not concept_store.exists_concept_store(store_path):
+        print("Concept names vectors store not found. \nComputing store...")
+        self.__save_concept_store(store_path)
       
-        self.concept_name_vectors_df = pd.read_csv(COM.CSV_ST_CONCEPT_NAMES_GLOVE_PATH + \
-                                                   str(self.vector_dimension) + "d.csv", 
-                                                   header=None)
-      elif vectorifier.internal_representation == "bert":
-        if not os.path.isfile(COM.CSV_ST_CONCEPT_NAMES_BERT_PATH + \
-                              COM.FILENAME_CSV_ST_CONCEPT_NAMES_BERT):
-          print("Concept names bert vectors file not found. \nComputing file...")
-          self.__save_csv_concept_name_bert_vectors()
+      if concept_store.load_concept_store(store_path).tree_hash != loaded_json_hash:
+        print("Symptom tree changed. \nUpdating concept names vectors store...")
+        self.__update_concept_store(store_path)
       
-        self.concept_name_vectors_df = pd.read_csv(COM.CSV_ST_CONCEPT_NAMES_BERT_PATH + \
-                                                   COM.FILENAME_CSV_ST_CONCEPT_NAMES_BERT, 
-                                                   header=None)
-    
+      self.concept_store = concept_store.load_concept_store(store_path)
+      
+      self.__quantized_concept_vectors = None
+      if quantization is not None:
+        if rerank_candidates < 1:
+          raise Exception("rerank_candidates must be >= 1")
+        self.__rerank_candidates = rerank_candidates
+        self.__quantized_concept_vectors = QuantizedMatrix(self.concept_store.vectors, quantization)
+      
+      if use_ann and use_hierarchical_search:
+        raise Exception("use_ann and use_hierarchical_search can't be used together")
+      
+      self.__ann_index = None
+      if use_ann:
+        if ann_probes < 1:
+          raise Exception("ann_probes must be >= 1")
+        self.__ann_probes = ann_probes
+        self.__ann_index = self.__load_ann_index(store_path, ann_lists)
+      
+      self.__hierarchical_index = None
+      if use_hierarchical_search:
+        if beam_width < 1:
+          raise Exception("beam_width must be >= 1")
+        self.__beam_width = beam_width
+        self.__hierarchical_index = HierarchicalIndex(self.tree, self.concept_store)
+      
+      self.__search_settings = (quantization,
+                                rerank_candidates if quantization is not None else None,
+                                self.__ann_index.n_lists if use_ann else None,
+                                ann_probes if use_ann else None,
+                                beam_width if use_hierarchical_search else None)
+      
+      self.__build_body_part_index()
+      
+      if memo_size < 0:
+        raise Exception("memo_size must be >= 0")
+      self.__memo_size = memo_size
+      self.memo_hits = 0
+      self.memo_misses = 0
+      if memo_size == 0:
+        self.__memo = None
+      elif persist_memo:
+        self.__memo = self.__load_memo()
+      else:
+        self.__memo = OrderedDict()
     
-
+  
   """
-  GloVe vectors of concept names are precomputed and saved in a csv file.
-  If the file not exists, compute them and save them. 
+  Vectors of concept names are precomputed and saved in a concept store.
+  If the csv file computed by the previous versions exists, its vectors are reused,
+  otherwise compute them.
   """
-  def __save_csv_concept_name_glove_vectors(self):
-    df = self.__get_df_concept_names_vectors(self.root)
-
-    os.makedirs(COM.CSV_ST_CONCEPT_NAMES_GLOVE_PATH, exist_ok=True)
-    
-    df.to_csv(COM.CSV_ST_CONCEPT_NAMES_GLOVE_PATH + \
-              str(self.vector_dimension) + "d.csv", 
-              index=False, header=False)
+  def __save_concept_store(self, store_path):
+    if self.vectorifier.internal_representation == "glove":
+      csv_path = COM.CSV_ST_CONCEPT_NAMES_GLOVE_PATH + str(self.vector_dimension) + "d.csv"
+    elif self.vectorifier.internal_representation == "bert":
+      csv_path = COM.CSV_ST_CONCEPT_NAMES_BERT_PATH + COM.FILENAME_CSV_ST_CONCEPT_NAMES_BERT
+    
+    if os.path.isfile(csv_path):
+      df = pd.read_csv(csv_path, header=None, keep_default_na=False)
+      concept_names = df[0].tolist()
+      cuis = df[1].tolist()
+      hashes = concept_store.get_content_hashes(cuis,
+                                                concept_names,
+                                                self.vectorifier.internal_representation,
+                                                self.vector_dimension)
+      # the tree hash is left empty: the store is checked against the tree at the next step
+      concept_store.save_concept_store(store_path,
+                                       concept_names,
+                                       cuis,
+                                       df.iloc[:, 2:(self.vector_dimension+2)].to_numpy(),
+                                       hashes)
+    else:
+      self.__update_concept_store(store_path)
   
   
   """
-  Bert vectors of concept names are precomputed and saved in a csv file.
-  If the file not exists, compute them and save them. 
+  Load the IVF index of the concept store, building it if missing
   """
-  def __save_csv_concept_name_bert_vectors(self):
-    df = self.__get_df_concept_names_vectors(self.root)
-
-    os.makedirs(COM.CSV_ST_CONCEPT_NAMES_BERT_PATH, exist_ok=True)
+  def __load_ann_index(self, store_path, ann_lists):
+    if ann_lists is None:
+      ann_lists = ann_index.get_default_number_lists(len(self.concept_store))
     
-    df.to_csv(COM.CSV_ST_CONCEPT_NAMES_BERT_PATH + COM.FILENAME_CSV_ST_CONCEPT_NAMES_BERT, 
-              index=False, header=False)
+    index_path = ann_index.get_ivf_index_path(store_path, ann_lists)
+    if not ann_index.exists_ivf_index(index_path):
+      print("Approximate search index not found. \nComputing index...")
+      ann_index.build_ivf_index(index_path, self.concept_store.vectors, ann_lists)
+    
+    return ann_index.load_ivf_index(index_path)
   
   
-  def __get_df_concept_names_vectors(self, parent):
-    parent_vector = self.vectorifier.vectorize_concept_name(parent.get_concept_name())
-    
-    if not parent_vector.empty:
-      df = pd.DataFrame(parent_vector).T
-      df.insert(0, "concept_name", parent.get_concept_name())
-      df.insert(1, "cui", parent.name)
-    else:
-      df = pd.DataFrame()
-    
-    for child in parent.children:
-      df = df.append(self.__get_df_concept_names_vectors(child))
-      
-    return df
+  """
+  Vectorize the concept names of the nodes added or changed since the store was built
+  and drop the removed ones
+  """
+  def __update_concept_store(self, store_path):
+    # rows in pre-order, as the nodes are numbered
+    concept_store.build_concept_store(store_path,
+                                      self.tree.normalized_concept_names,
+                                      list(self.tree.cuis[self.tree.cui_ids]),
+                                      self.vectorifier,
+                                      loaded_json_hash)
   
   
-    
   def get_most_similar_cui_given_body_part_token(self,
                                                  token,
                                                  body_part,
@@ -124,17 +248,231 @@ class SymptomTree:
                                                min_similarity=0):
     
     return self.__get_most_similar_cui_given_token(token, min_similarity)
-
+  
+  
+  """
+  Batch version of get_most_similar_cui_given_symptom_token / ..._body_part_token,
+  for all the tokens of a sentence or of a whole corpus.
+  
+  Parameters in:
+    - tokens: list of tokens
+    - body_parts: list parallel to tokens, the body part where to search each token
+                  (None => all the concept names). If not passed, no token is restricted.
+  
+  Returns the list of the dicts returned for each token by get_most_similar_cui_given_..._token.
+  
+  The best matches are memoized by (token, body part): only the tokens not in the memo
+  are searched. The best match of a token does not depend on the other tokens searched
+  with it (see __search_best_matches), so it can be reused by any later batch.
+  """
+  def get_most_similar_cuis_given_tokens(self, tokens, body_parts=None, min_similarity=0):
+    if body_parts is None:
+      body_parts = [None] * len(tokens)
+    
+    keys = [(token, None if body_part is None else body_part.id_bp)
+            for token, body_part in zip(tokens, body_parts)]
+    
+    # key => (CUI, similarity) of the best match, None if the token can't be vectorified
+    best_matches = {}
+    missing = {}
+    for key, body_part in zip(keys, body_parts):
+      if key in best_matches:
+        self.memo_hits += 1
+      elif key in missing:
+        # repeated in the batch, but not found in the memo
+        self.memo_misses += 1
+      elif self.__memo is not None and key in self.__memo:
+        self.__memo.move_to_end(key)
+        best_matches[key] = self.__memo[key]
+        self.memo_hits += 1
+      else:
+        missing[key] = body_part
+        self.memo_misses += 1
+    
+    if len(missing) > 0:
+      new_best_matches = self.__search_best_matches(list(missing), list(missing.values()))
+      best_matches.update(new_best_matches)
+      
+      if self.__memo is not None:
+        self.__memo.update(new_best_matches)
+        while len(self.__memo) > self.__memo_size:
+          self.__memo.popitem(last=False)
+    
+    ret = []
+    for key in keys:
+      if best_matches[key] is not None and best_matches[key][1] > min_similarity:
+        ret.append({"found": "yes", "predicted_cui": best_matches[key][0], "similarity": best_matches[key][1]})
+      else:
+        ret.append({"found": "no"})
+    
+    return ret
+  
+  
+  """
+  Returns the number of hits and misses of the memo of the best matches and its size
+  """
+  def get_memo_statistics(self):
+    return {"hits": self.memo_hits,
+            "misses": self.memo_misses,
+            "size": 0 if self.__memo is None else len(self.__memo)}
+  
+  
+  """
+  Save the memo of the best matches in COM.PICKLE_TOKEN_MEMO_PATH,
+  to be loaded by the next SymptomTree with the same settings (see __get_memo_path)
+  """
+  def save_memo(self):
+    if self.__memo is None:
+      return
+    
+    os.makedirs(COM.PICKLE_TOKEN_MEMO_PATH, exist_ok=True)
+    
+    def write(tmp_path):
+      with open(tmp_path, "wb") as f:
+        pickle.dump(self.__memo, f, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    COM.write_file_atomically(self.__get_memo_path(), write)
+  
+  
+  def __load_memo(self):
+    try:
+      with open(self.__get_memo_path(), "rb") as f:
+        memo = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+      return OrderedDict()
+    
+    while len(memo) > self.__memo_size:
+      memo.popitem(last=False)
+    
+    return memo
+  
+  
+  """
+  The best matches depend on the settings of the search, on the vectorifier, on the
+  concept store and on the concept names of the body parts, so a memo is saved in a file named after the hash of all of them
+  """
+  def __get_memo_path(self):
+    settings = [COM.TOKEN_MEMO_VERSION,
+                self.vectorifier.internal_representation,
+                self.vector_dimension,
+                getattr(self.vectorifier, "number_glove_words", None),
+                self.vectorifier.subsentence_strategy,
+                self.vectorifier.max_subset_size,
+                self.vectorifier.max_subsentences,
+                COM.SIMILARITY_MEASURE_SUPPORTED[COM.SIMILARITY_MEASURE],
+                self.concept_store.tree_hash,
+                self.__body_parts_hash,
+                self.__search_settings]
+    
+    return COM.PICKLE_TOKEN_MEMO_PATH + hashlib.sha1(repr(settings).encode("utf-8")).hexdigest() + ".pickle"
+  
+  
+  """
+  Returns a dict key => (CUI, similarity) of the best match of each (token, id of the body part),
+  None if the token can't be vectorified.
+  
+  The subsentences of all the tokens are vectorified together and each distinct subsentence
+  is scored once for each body part, with a product by blocks of COM.SEARCH_BLOCK_SIZE
+  subsentences. With the approximate searches (hierarchical, or IVF outside the body parts)
+  the tokens are searched one at a time, because the candidates depend on the subsentences:
+  so the result of a token does not depend on the other tokens of the batch.
+  """
+  def __search_best_matches(self, keys, body_parts):
+    distinct_tokens = list(dict.fromkeys(token for token, _ in keys))
+    subsentences_and_matrices = self.vectorifier.get_subsentences_and_matrices(distinct_tokens)
+    
+    # distinct subsentences of all the tokens, stacked in one matrix
+    subsentence_rows = {}
+    vectors = []
+    token_rows = {}
+    for token, (subsentences, matrix) in zip(distinct_tokens, subsentences_and_matrices):
+      rows = []
+      for subsentence, vector in zip(subsentences, matrix):
+        if subsentence not in subsentence_rows:
+          subsentence_rows[subsentence] = len(subsentence_rows)
+          vectors.append(vector)
+        rows.append(subsentence_rows[subsentence])
+      token_rows[token] = np.array(rows, dtype=np.int64)
+    
+    subsentences_matrix = np.zeros((len(vectors), self.vector_dimension), dtype=np.float32)
+    if len(vectors) > 0:
+      subsentences_matrix[:] = vectors
+    
+    # group the tokens that are searched in the same concept names
+    groups = {}
+    for key, body_part in zip(keys, body_parts):
+      token, id_bp = key
+      if self.__has_approximate_candidates(body_part):
+        group_key = (id_bp, token)
+      else:
+        group_key = id_bp
+      groups.setdefault(group_key, (body_part, []))[1].append(key)
+    
+    ret = {key: None for key in keys}
+    for body_part, group_keys in groups.values():
+      group_rows = np.unique(np.concatenate([token_rows[token] for token, _ in group_keys]))
+      if len(group_rows) == 0:
+        continue
+      
+      best_cuis, best_similarities = self.__get_best_cuis_given_subsentences(subsentences_matrix[group_rows],
+                                                                             body_part)
+      
+      for key in group_keys:
+        # there are no vectorizable subsentences
+        if len(token_rows[key[0]]) == 0:
+          continue
+        
+        # the best subsentence of the token, the first one if more are equally similar
+        token_positions = np.searchsorted(group_rows, token_rows[key[0]])
+        best = token_positions[np.argmax(best_similarities[token_positions])]
+        ret[key] = (best_cuis[best], best_similarities[best])
+    
+    return ret
+  
+  
+  """
+  Returns the k most similar concept names of each subsentence of the token,
+  as a dict subsentence => list of (CUI, similarity) ordered by decreasing similarity.
+  With quantization, at most rerank_candidates concept names are returned for each subsentence.
+  
+  If body_part is passed then search only in the symptoms related to that body part.
+  The search is the same of get_most_similar_cuis_given_tokens (approximate if enabled),
+  by blocks of COM.SEARCH_BLOCK_SIZE subsentences.
+  """
+  def get_top_k_cuis_given_token(self, token, k=1, body_part=None):
+    subsentences, subsentences_matrix = self.vectorifier.get_subsentences_and_matrix(token)
+    
+    if subsentences == []:
+      return {}
+    
+    rows, concept_names_matrix = self.__get_candidate_rows(subsentences_matrix, body_part)
+    cuis = self.concept_store.cuis if rows is None else self.concept_store.cuis[rows]
+    
+    ret = {}
+    for start in range(0, len(subsentences), COM.SEARCH_BLOCK_SIZE):
+      block = subsentences_matrix[start:(start + COM.SEARCH_BLOCK_SIZE)]
+      similarity_matrix = self.__get_similarity_matrix(block, rows, concept_names_matrix)
+      indexes, similarities = COM.get_top_k(similarity_matrix, k)
+      
+      # with quantization, the concept names that are not re-ranked have similarity -inf
+      for i, subsentence in enumerate(subsentences[start:(start + COM.SEARCH_BLOCK_SIZE)]):
+        ret[subsentence] = [(cui, simil)
+                            for cui, simil in zip(cuis[indexes[i]], similarities[i])
+                            if np.isfinite(simil)]
+    
+    return ret
+  
   
   """
   Given a token from the Answer Interpreter, calculate the subsentences within it
-  (all the possible subsets of the token) and get a list of tuples like this:
+  (all the possible subsets of the token) and get a dict like this:
   
-    ('cui', 0.89)
-    number cui, similarity
+    {"found": "yes", "predicted_cui": 'cui', "similarity": 0.89}
     
-  If min_similarity is passed, a tuple is produced only if the best match has
-  the similarity > min_similarity. Otherwise, it returns None.
+  with the concept name most similar to any of the subsentences.
+  
+  If min_similarity is passed, the CUI is returned only if the best match has
+  the similarity > min_similarity. Otherwise, it returns {"found": "no"}.
   
   If body_part is passed then search only in the symptoms related to that body part
   """
@@ -142,103 +480,151 @@ class SymptomTree:
                                          token,
                                          min_similarity=0,
                                          body_part=None):
-    subsentences = self.vectorifier.get_subsentences_and_vectors(token)
+    return self.get_most_similar_cuis_given_tokens([token], [body_part], min_similarity)[0]
+  
+  
+  """
+  Returns the CUI of the most similar concept name of each subsentence and its similarity,
+  computing the similarities by blocks of COM.SEARCH_BLOCK_SIZE subsentences.
+  The candidates are chosen once for all the subsentences (see __get_candidate_rows)
+  """
+  def __get_best_cuis_given_subsentences(self, subsentences_matrix, body_part=None):
+    rows, concept_names_matrix = self.__get_candidate_rows(subsentences_matrix, body_part)
+    cuis = self.concept_store.cuis if rows is None else self.concept_store.cuis[rows]
     
-    # there are no vectorizable subsentences
-    if subsentences == []:
-      return {"found": "no"}
+    best_cuis = []
+    best_similarities = []
+    
+    for start in range(0, len(subsentences_matrix), COM.SEARCH_BLOCK_SIZE):
+      block = subsentences_matrix[start:(start + COM.SEARCH_BLOCK_SIZE)]
+      similarity_matrix = self.__get_similarity_matrix(block, rows, concept_names_matrix)
+      
+      columns = similarity_matrix.argmax(axis=1)
+      best_cuis.append(cuis[columns])
+      best_similarities.append(similarity_matrix[np.arange(len(block)), columns])
     
-    if body_part is None:
-      concept_names_vectors = self.concept_name_vectors_df
+    return np.concatenate(best_cuis), np.concatenate(best_similarities)
+  
+  
+  """
+  True if the concept names where to search depend on the subsentences
+  (hierarchical search, or IVF index outside the body parts)
+  """
+  def __has_approximate_candidates(self, body_part=None):
+    return self.__hierarchical_index is not None or (self.__ann_index is not None and body_part is None)
+  
+  
+  """
+  Returns the tuple (rows, concept_names_matrix) of the concept names where to search
+  the subsentences: rows of the concept store (None => all of them) and the contiguous
+  matrix of their vectors if precomputed (None otherwise).
+  
+  Parameters in:
+    - subsentences_matrix: matrix that has the vectors of subsentences on rows.
+                           With the approximate searches the candidates depend on all of them,
+                           so they must be the subsentences of one token
+    - body_part: if passed, search only in the concept names related to it
+                 (None => all the concept names)
+  """
+  def __get_candidate_rows(self, subsentences_matrix, body_part=None):
+    if self.__hierarchical_index is not None:
+      if body_part is None:
+        root_nodes = [self.root]
+      else:
+        root_nodes = self.__get_root_nodes_given_concept_names(body_part.root_nodes)
+      return self.__hierarchical_index.get_candidates(subsentences_matrix, root_nodes, self.__beam_width), None
+    elif body_part is None:
+      if self.__ann_index is not None:
+        return self.__ann_index.get_candidates(subsentences_matrix, self.__ann_probes), None
+      return None, None
+    else:
+      return self.__get_rows_related_to_body_part(body_part)
+  
+  
+  """
+  Returns the similarity matrix between the subsentences and the concept names of rows
+  (see __get_candidate_rows)
+  """
+  def __get_similarity_matrix(self, subsentences_matrix, rows, concept_names_matrix):
+    if self.__quantized_concept_vectors is None:
+      similarity_matrix = self.concept_store.similarity(subsentences_matrix, rows, concept_names_matrix)
     else:
-      concept_names_vectors = self.__get_concept_names_vectors_related_to_body_part(body_part)
+      similarity_matrix = get_reranked_similarity_matrix(subsentences_matrix,
+                                                         self.__quantized_concept_vectors,
+                                                         self.concept_store,
+                                                         rows,
+                                                         self.__rerank_candidates)
     
-    symptoms_df = self.__get_most_similar_symptoms_given_subsentences(subsentences,
-                                                                      concept_names_vectors)
+    return similarity_matrix
+  
+  
+  """
+  Returns the tuple (rows of the concept store related to the body part, contiguous matrix
+  of their vectors), the concept names in the subtrees of its root nodes.
+  
+  The matrix is built the first time the body part is searched, and only without quantization
+  (the quantized search doesn't read it, it would be a full precision copy): None otherwise
+  """
+  def __get_rows_related_to_body_part(self, body_part):
+    if body_part.id_bp not in self.__body_part_rows:
+      self.__body_part_rows[body_part.id_bp] = self.__get_rows_given_root_concept_names(body_part.root_nodes)
+    rows = self.__body_part_rows[body_part.id_bp]
     
-    symptoms_df = symptoms_df.sort_values("similarity", ascending=False)
+    if self.__quantized_concept_vectors is not None:
+      return rows, None
     
-    _, cui = symptoms_df.iloc[0][1]
-    simil = symptoms_df.iloc[0][2]
+    if body_part.id_bp not in self.__body_part_matrices:
+      self.__body_part_matrices[body_part.id_bp] = np.ascontiguousarray(self.concept_store.vectors[rows])
     
-    if simil > min_similarity:
-      return {"found": "yes", "predicted_cui": cui, "similarity": simil}
-    else:
-      return {"found": "no"}
+    return rows, self.__body_part_matrices[body_part.id_bp]
   
   
   """
-  Function that returns the most suitable concept name for each subsentence,
-  where 'suitable' here means more similar.
-  
-  Parameters in:
-    - subsentences: list of ('subsentence', vector of the subsentence)
-    - concept_names: dataframe representing concept names and their vector representations
-  
-  Returns:
-    a pandas DataFrame with columns:
-      - subsentence
-      - tuple_symptom : ('concept name', CUI)
-      - similarity
-      => the number of rows is equal to the number of subsentences
-  """
-  def __get_most_similar_symptoms_given_subsentences(self,
-                                                       subsentences,
-                                                       concept_names):
-    # Matrix that has the vectors of subsentences on rows
-    # shape of A is #subsentences x #dimensions_inter_repr
-    A = np.array([list(vect) for (_, vect) in subsentences])
-    # lists preserves the visit order
-    dictA = {}
-    i = 0
-    for (subsentence, _) in subsentences:
-      dictA[i] = subsentence
-      i += 1
-    
-    # Matrix that has the vectors of concept names on rows
-    # shape of B is #concept_names x #dimensions_inter_repr
-    B = np.array(concept_names.iloc[:, 2:(self.vector_dimension+2)])
-    dictB = {}
-    list_concept_names = concept_names[0].tolist()
-    list_cuis = concept_names[1].tolist()
-    
-    indexes = list(zip(list_concept_names, list_cuis))
-    
-    i = 0
-    for concept_name, cui in indexes:
-      dictB[i] = (concept_name, cui)
-      i += 1
-    
-    similarity_matrix = COM.similarity_matrices(A, B)
-    
-    indexes_max_rows = similarity_matrix.argmax(axis=1)
+  For each body part in COM.CSV_ST_BODY_PARTS_TAGGING_PATH, precompute the rows of the
+  concept store related to it. The submatrices of their vectors are built when needed
+  (see __get_rows_related_to_body_part): the subtrees overlap, all of them together
+  could take more memory than the whole store.
+  The hash of the file is kept for the memo of the best matches (see __get_memo_path)
+  """
+  def __build_body_part_index(self):
+    self.__body_part_rows = {}
+    self.__body_part_matrices = {}
     
-    ret = []
-    i_subsentence = 0
-    for i_concept_name in indexes_max_rows:
-      ret.append((dictA[i_subsentence], 
-                  dictB[i_concept_name], 
-                  similarity_matrix[i_subsentence][i_concept_name]))
-      i_subsentence += 1
+    with open(COM.CSV_ST_BODY_PARTS_TAGGING_PATH, "rb") as f:
+      body_parts_csv = f.read()
+    self.__body_parts_hash = hashlib.sha256(body_parts_csv).hexdigest()
     
-    return pd.DataFrame(ret, columns=["subsentence", "tuple_symptom", "similarity"])
+    df = pd.read_csv(io.BytesIO(body_parts_csv), sep="|")
+    for id_bp, df_bp in df.groupby("id_body_part"):
+      self.__body_part_rows[id_bp] = self.__get_rows_given_root_concept_names(df_bp["concept_name"].tolist())
   
   
-  def __get_concept_names_vectors_related_to_body_part(self, body_part):
-    list_root_nodes = body_part.root_nodes
-    root_nodes = list(map(self.__get_node_by_concept_name, list_root_nodes))
-    
-    if root_nodes == []:
-      # search in the whole tree
-      root_nodes = [self.__get_node_by_concept_name("symptoms")]
+  def __get_rows_given_root_concept_names(self, list_root_nodes):
+    root_nodes = self.__get_root_nodes_given_concept_names(list_root_nodes)
     
     list_filtered_concept_names = []
     for root_node in root_nodes:
       l = self.__get_concept_names_of_subtree(root_node)
       list_filtered_concept_names += l
     
-    selector = self.concept_name_vectors_df[0].isin(list_filtered_concept_names)
-    return self.concept_name_vectors_df[selector]
+    selector = np.isin(self.concept_store.concept_names, list_filtered_concept_names)
+    return np.flatnonzero(selector)
+  
+  
+  """
+  Returns the nodes of the tree with the concept names of the root nodes of a body part,
+  the root of the whole tree if there are none
+  """
+  def __get_root_nodes_given_concept_names(self, list_root_nodes):
+    root_nodes = list(map(self.get_node_by_concept_name, list_root_nodes))
+    # concept names of the csv that are not in the tree
+    root_nodes = [root_node for root_node in root_nodes if root_node is not None]
+    
+    if root_nodes == []:
+      # search in the whole tree
+      root_nodes = [self.get_node_by_concept_name("symptoms")]
+    
+    return root_nodes
   
       
   """
@@ -247,33 +633,46 @@ class SymptomTree:
   
   """
   
-  def __get_node_by_concept_name(self, concept_name):
-    return at.find(self.root, filter_=lambda node: node.get_concept_name()==concept_name)
+  """
+  Returns the node with that concept name (compared after the normalization),
+  None if it is not in the tree
+  """
+  def get_node_by_concept_name(self, concept_name):
+    position = self.tree.get_position_by_concept_name(COM.strip_string(concept_name))
+    return None if position is None else self.tree.get_node(position)
+  
+  
+  """
+  Returns the list of the nodes with that CUI, in pre-order
+  """
+  def get_nodes_by_cui(self, cui):
+    return [self.tree.get_node(position) for position in self.tree.get_positions_by_cui(cui)]
+  
+  
+  """
+  Returns True if a node with CUI cui is in the subtree of the first node (in pre-order)
+  with CUI root_cui, the same subtree returned by get_cuis_subtree_given_cui_root.
+  Returns False if root_cui is not in the tree.
+  """
+  def is_in_subtree(self, cui, root_cui):
+    return self.tree.is_in_subtree(cui, root_cui)
   
   
   def __get_first_node_by_cui(self, cui):
-    nodes = at.findall(self.root, filter_=lambda node: node.name==cui)
+    nodes = self.get_nodes_by_cui(cui)
     if len(nodes) > 0:
       return nodes[0]
   
   
+  # the subtree of a node is a slice of the positions in pre-order
   def __get_concept_names_of_subtree(self, node):
-    concept_names = [node.concept_name]
-    
-    for child in node.children:
-      concept_names += self.__get_concept_names_of_subtree(child)
-    
-    return concept_names
+    return self.tree.concept_names[node.position:(node.position + self.tree.subtree_sizes[node.position])]
   
   
   def __get_cuis_of_subtree(self, node):
     if node is not None:
-      cuis = [node.name]
-      
-      for child in node.children:
-        cuis += self.__get_cuis_of_subtree(child)
-      
-      return cuis
+      positions = slice(node.position, node.position + self.tree.subtree_sizes[node.position])
+      return list(self.tree.cuis[self.tree.cui_ids[positions]])
     else:
       return ["CUIplaceholder"]
   
@@ -287,5 +686,5 @@ class SymptomTree:
   
   
   def render_tree(self, root):
-      return str(at.RenderTree(root, style=at.ContStyle()))
-    
+      return self.tree.render(root.position)
+    
\ No newline at end of file
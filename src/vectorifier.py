@@ -1,8 +1,11 @@
 import pandas as pd
 import commons as COM
+import numpy as np
 import itertools
-from sentence_pos_tagger import SentencePOSTagger
-from bert_serving.client import BertClient
+import hashlib
+import glove_store
+from sentence_pos_tagger import get_default_sentence_pos_tagger
+from bert_client_pool import BertClientPool
 
 
 class Vectorifier:
@@ -17,13 +20,30 @@ class Vectorifier:
     number_glove_words: take the first n words from GloVe dictionary (they are ordered by frequency)
     dimension_glove_vectors: can be 50, 100, 200, 300
     
-  spt: SentencePOSTagger instance for optimization. If not passed, initialize a new instance
+  spt: SentencePOSTagger instance for optimization. If not passed, the default instance of the process is used
+  
+  Subsentences parameters --
+    subsentence_strategy: how the subsentences of a token are generated (see COM.SUBSENTENCE_STRATEGIES)
+    max_subset_size: maximum number of words of a subsentence with the "max_size" strategy
+    max_subsentences: hard ceiling on the number of subsentences generated for a token (None => no ceiling)
+  
+  BERT parameters --
+    bert_batch_size: maximum number of sentences sent to the bert server in one request
+  
+  embedding_cache: EmbeddingCache instance. If passed, bert vectors of texts are
+                   looked up in it before being requested to the bert server.
+                   GloVe vectors are not cached: computing them is cheaper than a lookup
   """
   def __init__(self,
                internal_representation,
                number_glove_words = COM.DEFAULT_NUM_IMPORTED_GLOVE_VECTORS,
                dimension_glove_vectors = COM.POSSIBLE_GLOVE_DIMENSIONS[COM.DEFAULT_GLOVE_DIMENSION],
-               spt=None):
+               spt=None,
+               subsentence_strategy = COM.SUBSENTENCE_STRATEGIES[COM.DEFAULT_SUBSENTENCE_STRATEGY],
+               max_subset_size = COM.DEFAULT_MAX_SUBSET_SIZE,
+               max_subsentences = COM.MAX_SUBSENTENCES_PER_TOKEN,
+               bert_batch_size = COM.DEFAULT_BERT_BATCH_SIZE,
+               embedding_cache = None):
     
     if internal_representation not in COM.ADMITTED_REPRESENTATIONS:
       raise Exception("A proper internal representation should be specified.\n"
@@ -31,6 +51,18 @@ class Vectorifier:
     
     self.internal_representation = internal_representation
     
+    self.__cache = embedding_cache
+    
+    if subsentence_strategy not in COM.SUBSENTENCE_STRATEGIES:
+      raise Exception("Supported subsentence strategies: " + ", ".join(COM.SUBSENTENCE_STRATEGIES))
+    
+    if max_subset_size < 1 or (max_subsentences is not None and max_subsentences < 1):
+      raise Exception("max_subset_size and max_subsentences must be >= 1")
+    
+    self.subsentence_strategy = subsentence_strategy
+    self.max_subset_size = max_subset_size
+    self.max_subsentences = max_subsentences
+    
     if internal_representation == "glove":
       if dimension_glove_vectors not in COM.POSSIBLE_GLOVE_DIMENSIONS:
         raise Exception("Dimension_glove_vector should be 50 or 100 or 200 or 300")
@@ -39,76 +71,123 @@ class Vectorifier:
         raise Exception("The maximum number of glove words is " + str(COM.MAX_NUM_IMPORTED_GLOVE_VECTORS))
       
       self.d = dimension_glove_vectors
+      self.number_glove_words = number_glove_words
+      
+      words, word_vectors = glove_store.load_glove_store(self.d, number_glove_words)
       
-      self.__word_vectors_df = pd.read_csv(COM.TXT_GLOVE_PATH + \
-                                           "glove.6B." + str(self.d) + "d.txt",
-                                           sep=" ",
-                                           engine="python",
-                                           nrows=number_glove_words,
-                                           quoting=3,
-                                           header=None)
+      self.__build_word_index(words, word_vectors)
     elif internal_representation == "bert":
       self.d = COM.DIMENSION_BERT_EMBEDDINGS
-      # Initialize a new BertClient
-      self.__bc = BertClient(ip=COM.IP_BERT_SERVER, output_fmt="list")
+      # Initialize a new pool of connections to the bert server
+      self.__bc = BertClientPool(batch_size=bert_batch_size)
       # ---
     
+    # the embedding cache is shared by all the runs, the vectors are keyed by all the settings they depend on
+    settings = [internal_representation, self.d, getattr(self, "number_glove_words", None)]
+    self.__cache_representation = internal_representation + "-" + \
+                                  hashlib.sha1(repr(settings).encode("utf-8")).hexdigest()
+    
     if spt == None:
-      self.__spt = SentencePOSTagger()
+      self.__spt = get_default_sentence_pos_tagger()
     else:
       self.__spt = spt
     
   
   
   """
-  Given a sentence and a knowledge base (mapping word => vector),
-  calculate the mean vector between the vectorified words
-
-  If the concept name contains a word that is not in the dictionary, return an empty DataFrame
+  GloVe words are indexed in a dictionary word => row of a contiguous float32 matrix,
+  so that looking up a word does not scan the whole vocabulary
+  
+  words: list of words, ordered as the rows of word_vectors
+  word_vectors: float32 matrix (memory-mapped from the GloVe binary store)
+  """
+  def __build_word_index(self, words, word_vectors):
+    self.__word_vectors = word_vectors
+    
+    self.__word_index = {}
+    for i, word in enumerate(words):
+      if word not in self.__word_index:
+        self.__word_index[word] = i
+  
+  
+  """
+  Given a sentence, returns the list of rows of its words in the GloVe matrix.
+  If a word is not in the dictionary, returns None
+  """
+  def __get_word_rows(self, sentence):
+    rows = []
+    for token in sentence.split():
+      row = self.__word_index.get(token)
+      if row is None:
+        return None
+      rows.append(row)
+    
+    return rows
+  
+  
+  """
+  Given a list of sentences, returns the matrix of their bert vectors
+  (the row i is the vector of the sentence i).
+  
+  Sentences found in the embedding cache are not sent to the server.
+  The others are sent only once, even if duplicated, in requests of at most
+  bert_batch_size sentences, pipelined by the BertClientPool.
+  Sentences must not be empty.
+  """
+  def __encode_bert(self, sentences):
+    unique_sentences = list(dict.fromkeys(sentences))
+    
+    if self.__cache is not None:
+      vectors = self.__cache.get_many(self.__cache_representation, self.d, unique_sentences)
+    else:
+      vectors = {}
+    
+    missing_sentences = [sentence for sentence in unique_sentences if sentence not in vectors]
+    
+    if missing_sentences != []:
+      missing_vectors = np.asarray(self.__bc.encode(missing_sentences), dtype=np.float32)
+      missing_vectors = dict(zip(missing_sentences, missing_vectors))
+      
+      if self.__cache is not None:
+        self.__cache.put_many(self.__cache_representation, self.d, missing_vectors)
+      
+      vectors.update(missing_vectors)
+    
+    matrix = np.zeros((len(sentences), self.d), dtype=np.float32)
+    for i, sentence in enumerate(sentences):
+      matrix[i] = vectors[sentence]
+    
+    return matrix
+  
   
-  kb: column 0 => word
-      columns [1, dim + 1] => values of the vector
   """
-  def __vectorize(self, sentence, kb=None):
-    if kb is None:
-      # BERT
+  Given a sentence, calculate the mean vector between the vectorified words
+
+  If the sentence contains a word that is not in the dictionary, return an empty DataFrame
+  """
+  def __vectorize(self, sentence):
+    if self.internal_representation == "bert":
       if sentence.strip() != "":
-        vector_list = self.__bc.encode([sentence])
-        return pd.Series(vector_list[0])
+        return pd.Series(self.__encode_bert([sentence])[0])
       else:
         return pd.Series()
     else:
       # GLOVE
-      tokens = sentence.split()
-      n_tokens = 0
+      rows = self.__get_word_rows(sentence)
       
-      final_df = pd.DataFrame()
+      if not rows:
+        return pd.DataFrame()
       
-      for token in tokens:
-        token_df = kb[kb[0].isin([token])]  
-        if not token_df.empty:
-          n_tokens = n_tokens + 1
-        else:
-          return pd.DataFrame() 
-        final_df = final_df.append(token_df)
+      vector = np.asarray(self.__word_vectors[rows]).mean(axis=0)
       
-      if not final_df.empty:
-        final_df = final_df.iloc[:,1:(self.d + 1)]
-        return final_df.sum(axis=0) / n_tokens
-      else:
-        return pd.DataFrame()
+      return pd.Series(vector, index=range(1, self.d + 1))
     
   
   def vectorize_word(self, word, stemming=True):
     if stemming:
       word = self.__spt.stem_sentence(word)
     
-    if self.internal_representation == "glove":
-      vector = self.__vectorize(word, self.__word_vectors_df)
-    elif self.internal_representation == "bert":
-      vector = self.__vectorize(word)
-    
-    return vector
+    return self.__vectorize(word)
   
   
   """
@@ -126,10 +205,42 @@ class Vectorifier:
       concept_name = self.__spt.stem_sentence(concept_name)
     # ---
     
+    return self.__vectorize(concept_name)
+  
+  
+  """
+  Given a list of concept names returns a tuple (matrix, vectorized)
+    - matrix: #concept_names x d, the row i is the vector of the concept name i
+    - vectorized: boolean array, False for the concept names that can't be vectorified
+                  (their rows are zeros)
+  
+  Concept names are stemmed in one batch (see SentencePOSTagger.stem_sentences)
+  and vectorified together:
+  with bert they are encoded in batched requests.
+  """
+  def vectorize_concept_names(self,
+                              concept_names,
+                              stemming=True):
+    print("Vectorizing " + str(len(concept_names)) + " concept names")
+    
+    if stemming:
+      concept_names = self.__spt.stem_sentences(concept_names)
+    
+    matrix = np.zeros((len(concept_names), self.d), dtype=np.float32)
+    vectorized = np.zeros(len(concept_names), dtype=bool)
+    
     if self.internal_representation == "glove":
-      return self.__vectorize(concept_name, self.__word_vectors_df)
+      for i, concept_name in enumerate(concept_names):
+        rows = self.__get_word_rows(concept_name)
+        if rows:
+          matrix[i] = np.asarray(self.__word_vectors[rows]).mean(axis=0)
+          vectorized[i] = True
     elif self.internal_representation == "bert":
-      return self.__vectorize(concept_name)
+      vectorized = np.array([concept_name.strip() != "" for concept_name in concept_names], dtype=bool)
+      not_empty = [concept_name for concept_name in concept_names if concept_name.strip() != ""]
+      matrix[vectorized] = self.__encode_bert(not_empty)
+    
+    return matrix, vectorized
   
   
   """
@@ -138,44 +249,154 @@ class Vectorifier:
     with the right internal representation
   """
   def get_subsentences_and_vectors(self, sentence):
-    words_set = set(sentence.split(" "))
-    subsentence_list = self.__subsentences(words_set)
+    subsentences, matrix = self.get_subsentences_and_matrix(sentence)
+    
+    return list(zip(subsentences, matrix))
+  
+  
+  """
+  Given a sentence,
+    returns a tuple (list of subsentences, matrix)
+    where the row i of the matrix (#subsentences x d) is the vector of the subsentence i
+  
+  The subsentences are generated from the words of the sentence
+  according to the subsentence strategy, at most max_subsentences of them.
+  Words that can't be vectorified (not in the GloVe dictionary) are dropped
+  before generating the subsentences. With the "spans" strategy the spans containing
+  them are skipped instead, so that the spans stay n-grams of the sentence.
+  """
+  def get_subsentences_and_matrix(self, sentence):
+    words = self.__get_words(sentence)
     
     if self.internal_representation == "glove":
-      subsentence_vectorified_list = [self.__vectorize(s, self.__word_vectors_df) for s in subsentence_list]
+      return self.__get_glove_subsentences_and_matrix(words)
     elif self.internal_representation == "bert":
-      subsentence_vectorified_list = [self.__vectorize(s) for s in subsentence_list]
-    
-    #delete subsentences that produce as vector an empty dataframe
-    ret = list(zip(subsentence_list, subsentence_vectorified_list))
-    ret1 = []
-    for t in ret:
-      (_, vect) = t
-      if not vect.empty:
-        ret1.append(t)
-
-    return ret1
+      subsentences = self.__get_bert_subsentences(words)
+      return subsentences, self.__encode_bert(subsentences)
+  
+  
+  """
+  Given a list of sentences,
+    returns for each sentence the tuple (list of subsentences, matrix)
+    as get_subsentences_and_matrix does.
+  
+  With bert the subsentences of all the sentences are encoded together in batched requests.
+  """
+  def get_subsentences_and_matrices(self, sentences):
+    if self.internal_representation == "glove":
+      return [self.get_subsentences_and_matrix(sentence) for sentence in sentences]
+    elif self.internal_representation == "bert":
+      subsentences_list = [self.__get_bert_subsentences(self.__get_words(sentence)) for sentence in sentences]
+      matrix = self.__encode_bert([s for subsentences in subsentences_list for s in subsentences])
+      
+      ret = []
+      start = 0
+      for subsentences in subsentences_list:
+        ret.append((subsentences, matrix[start:(start + len(subsentences))]))
+        start += len(subsentences)
+      
+      return ret
+  
+  
+  """
+  Returns the words of the sentence. The repeated words are dropped for the strategies
+  based on the subsets of the words, with "spans" they are kept so that the spans
+  are n-grams of the sentence
+  """
+  def __get_words(self, sentence):
+    words = [word for word in sentence.split(" ") if word != ""]
+    
+    if self.subsentence_strategy == "spans":
+      return words
+    
+    return list(dict.fromkeys(words))
+  
+  
+  def __get_bert_subsentences(self, words):
+    # with "spans" the same n-gram can occur more times in the sentence
+    return list(dict.fromkeys(self.__stringify_subset(words, subset) for subset in self.__subsets(len(words))))
   
   
-  def __subsentences(self, word_set):
-    subsets_of_words = self.__subsets(word_set)
-    return list(map(self.__stringify_tuple, subsets_of_words))
+  """
+  The sum of the vectors of a subset is the sum of the subset without its last word
+  plus the vector of that word. Subsets are generated by increasing size,
+  so the smaller subset has always been computed yet.
+  """
+  def __get_glove_subsentences_and_matrix(self, words):
+    if self.subsentence_strategy == "spans":
+      usable = [word in self.__word_index for word in words]
+    else:
+      words = [word for word in words if word in self.__word_index]
+      usable = None
+    
+    # the words that can't be vectorified take the row 0, never used by a subset
+    rows = [self.__word_index.get(word, 0) for word in words]
+    word_vectors = np.asarray(self.__word_vectors[rows], dtype=np.float32)
+    
+    subsets = self.__subsets(len(words), usable)
+    
+    # position 0 is the empty subset
+    positions = {(): 0}
+    for subset in subsets:
+      positions[subset] = len(positions)
+    
+    sums = np.zeros((len(subsets) + 1, self.d), dtype=np.float32)
+    
+    # all the subsets of the same size are summed in one shot
+    for _, level in itertools.groupby(subsets, key=len):
+      level = list(level)
+      level_positions = [positions[subset] for subset in level]
+      parent_positions = [positions[subset[:-1]] for subset in level]
+      last_words = [subset[-1] for subset in level]
+      
+      sums[level_positions] = sums[parent_positions] + word_vectors[last_words]
+    
+    sizes = np.array([len(subset) for subset in subsets], dtype=np.float32)
+    matrix = sums[1:] / sizes[:, np.newaxis]
+    
+    # with "spans" the same n-gram can occur more times in the sentence, the first one is kept
+    first_positions = {}
+    for i, subset in enumerate(subsets):
+      first_positions.setdefault(self.__stringify_subset(words, subset), i)
+    
+    return list(first_positions), matrix[list(first_positions.values())]
+  
   
+  """
+  Given the number of words n,
+  returns the subsets of word indexes (tuples of increasing indexes)
+  allowed by the subsentence strategy, ordered by size.
+  At most max_subsentences subsets are returned.
   
-  # S is the set, m the number 
-  def __subsets(self, S):
-    final_set = set()
-    for m in range(1, len(S) + 1):
-      s = set(itertools.combinations(S, m))
-      final_set = final_set.union(s)
-    return final_set
+  If usable (list of n booleans) is passed, the subsets with a not usable word are skipped
+  """
+  def __subsets(self, n, usable=None):
+    if self.subsentence_strategy == "max_size":
+      max_size = min(n, self.max_subset_size)
+    else:
+      max_size = n
+    
+    subsets = []
+    for size in range(1, max_size + 1):
+      if self.subsentence_strategy == "spans":
+        level = (tuple(range(i, i + size)) for i in range(n - size + 1))
+      else:
+        level = itertools.combinations(range(n), size)
+      
+      for subset in level:
+        if usable is not None and not all(usable[i] for i in subset):
+          continue
+        if len(subsets) == self.max_subsentences:
+          return subsets
+        subsets.append(subset)
+    
+    return subsets
   
   
-  # given a tuple of strings, return a mono string
-  def __stringify_tuple(self, t):
+  # given a list of words and a subset of their indexes, return a mono string
+  def __stringify_subset(self, words, subset):
     s = ""
-    for string in t:
-        s = s + string + " "
+    for i in subset:
+      s = s + words[i] + " "
     return s
   
-  